@@ -10,5 +10,11 @@ class snakeagent:
             return self.brain.get_action(state)
         return random.randint(0,3)
     
+    def freeze(self):
+        """swap the brain for its frozen policy; for play, not for evolution"""
+        if self.brain:
+            self.brain=self.brain.freeze()
+        return self
+    
     def reset(self):
         self.fitness=0
@@ -0,0 +1,197 @@
+import numpy as np
+from state_encoder import encoder_for,state_size,STATE_SIZE
+
+#action codes match snakegame: 0=up,1=down,2=left,3=right
+_DX=np.array([0,0,-1,1],dtype=np.int32)
+_DY=np.array([-1,1,0,0],dtype=np.int32)
+_OPPOSITE=np.array([1,0,3,2],dtype=np.int32)
+
+#death causes
+ALIVE=0
+WALL=1
+SELF=2
+LOOP=3
+STAGNATION=4
+STEP_CAP=5  #still alive when the evaluator's step budget ran out
+CAUSES=("alive","wall","self","loop","stagnation","step_cap")
+
+
+def mix64(x):
+    """splitmix64 finalizer over uint64 arrays"""
+    x=(x^(x>>np.uint64(30)))*np.uint64(0xbf58476d1ce4e5b9)
+    x=(x^(x>>np.uint64(27)))*np.uint64(0x94d049bb133111eb)
+    return x^(x>>np.uint64(31))
+
+
+def apple_priority(seeds,counts,n_cells):
+    """deterministic per-cell priorities for the next apple of each game
+
+    the apple goes to the free cell with the highest priority, so a game's
+    apple sequence depends only on its seed and how many apples it has eaten
+    """
+    seeds=np.asarray(seeds,dtype=np.uint64).reshape(-1,1)
+    counts=np.asarray(counts,dtype=np.uint64).reshape(-1,1)
+    cells=np.arange(n_cells,dtype=np.uint64).reshape(1,-1)
+    with np.errstate(over="ignore"):
+        x=mix64(seeds+counts*np.uint64(0x9e3779b97f4a7c15))
+        return mix64(x^(cells*np.uint64(0xd6e8feb86659fd93)))
+
+
+class BatchSnakeEnv:
+    """steps n independent snake games at once with numpy arrays
+
+    same rules as snakegame: walls and the snake's own body (tail included)
+    are fatal, 180 degree turns are ignored and eating an apple grows the
+    snake by one. dead games are frozen until the next reset()
+
+    with early_stop a game also ends when the head visits one cell more than
+    loop_threshold times within loop_window steps, or goes apple_timeout
+    steps without an apple
+
+    with vision the state also holds the 8 wall/body/apple rays of
+    state_encoder.rayencoder, read off the occupancy grid
+    """
+
+    def __init__(self,n,width=30,height=30,seeds=None,loop_window=64,loop_threshold=8,
+                 apple_timeout=200,early_stop=False,vision=False):
+        self.n=n
+        self.width=width
+        self.height=height
+        self.loop_window=loop_window
+        self.loop_threshold=loop_threshold
+        self.apple_timeout=apple_timeout
+        self.early_stop=early_stop
+        self.vision=vision
+        self.n_cells=width*height
+        self.capacity=self.n_cells+1
+        self.encoder=encoder_for(width,height)
+        self.seeds=seeds
+        self.reset()
+
+    def reset(self,seeds=None):
+        n=self.n
+        if seeds is None:
+            seeds=self.seeds
+        if seeds is None:
+            seeds=np.random.randint(0,2**63,size=n,dtype=np.uint64)
+        self.game_seeds=np.asarray(seeds,dtype=np.uint64).reshape(n)
+        #body is a ring buffer of flat cell indices, head at ptr
+        self.body=np.zeros((n,self.capacity),dtype=np.int32)
+        self.ptr=np.zeros(n,dtype=np.int32)
+        self.lengths=np.ones(n,dtype=np.int32)
+        self.occupancy=np.zeros((n,self.n_cells),dtype=bool)
+        self.heads=np.empty((n,2),dtype=np.int32)
+        self.heads[:,0]=self.width//2
+        self.heads[:,1]=self.height//2
+        start=self.heads[0,1]*self.width+self.heads[0,0]
+        self.body[:,0]=start
+        self.occupancy[:,start]=True
+        self.dirs=np.zeros(n,dtype=np.int32)#up
+        self.scores=np.zeros(n,dtype=np.int64)
+        self.steps=np.zeros(n,dtype=np.int64)
+        self.alive=np.ones(n,dtype=bool)
+        self.causes=np.zeros(n,dtype=np.int8)
+        self.apples=np.zeros(n,dtype=np.int32)
+        self.apple_counts=np.zeros(n,dtype=np.int64)
+        #ring buffer of recent head cells and per-cell visit counts in it
+        self.recent=np.zeros((n,self.loop_window),dtype=np.int32)
+        self.visits=np.zeros((n,self.n_cells),dtype=np.int16)
+        self.steps_since_apple=np.zeros(n,dtype=np.int64)
+        self.place_apples(np.arange(n))
+        self.state=self.get_state()
+        return self.state
+
+    def place_apples(self,idx):
+        """put a new apple on a free cell for each game in idx"""
+        if len(idx)==0:
+            return
+        prio=apple_priority(self.game_seeds[idx],self.apple_counts[idx],self.n_cells)
+        prio[self.occupancy[idx]]=0
+        cells=np.argmax(prio,axis=1).astype(np.int32)
+        #board full - no apple left to place
+        full=self.occupancy[idx].all(axis=1)
+        cells[full]=-1
+        self.apples[idx]=cells
+        self.apple_counts[idx]+=1
+
+    def tails(self,idx=None):
+        if idx is None:
+            idx=np.arange(self.n)
+        return self.body[idx,(self.ptr[idx]-self.lengths[idx]+1)%self.capacity]
+
+    def get_state(self,idx=None):
+        """(n,14) float32 array with the same features as snakegame.get_state
+        ((n,38) with vision)
+
+        with idx only the rows of those games are computed
+        """
+        if idx is None:
+            idx=np.arange(self.n)
+        out=np.empty((len(idx),state_size(self.vision)),dtype=np.float32)
+        heads=self.heads[idx,1]*self.width+self.heads[idx,0]
+        apples=np.maximum(self.apples[idx],0)
+        self.encoder.encode_batch(out[:,:STATE_SIZE],heads,self.tails(idx),apples,self.dirs[idx])
+        if self.vision:
+            self.encoder.rays.encode_batch(out[:,STATE_SIZE:],self.occupancy,idx,heads,apples)
+        return out
+
+    def step(self,actions):
+        """advance every live game by one move
+
+        actions is an (n,) array of action codes; entries for dead games are
+        ignored. returns (states,alive,scores) like snakegame.step, where
+        states is a buffer that the next step() overwrites in place
+        """
+        idx=np.flatnonzero(self.alive)
+        if len(idx)==0:
+            return self.state,self.alive.copy(),self.scores.copy()
+        actions=np.asarray(actions,dtype=np.int32)[idx]
+        cur=self.dirs[idx]
+        new=np.where(actions==_OPPOSITE[cur],cur,actions)
+        self.dirs[idx]=new
+        nx=self.heads[idx,0]+_DX[new]
+        ny=self.heads[idx,1]+_DY[new]
+        wall=(nx<0)|(nx>=self.width)|(ny<0)|(ny>=self.height)
+        cells=np.where(wall,0,ny*self.width+nx)
+        hit=self.occupancy[idx,cells]&~wall
+        dead=wall|hit
+        if dead.any():
+            self.alive[idx[dead]]=False
+            self.causes[idx[wall]]=WALL
+            self.causes[idx[hit]]=SELF
+        #move the survivors
+        keep=~dead
+        m=idx[keep]
+        cells=cells[keep]
+        self.heads[m,0]=nx[keep]
+        self.heads[m,1]=ny[keep]
+        ptr=(self.ptr[m]+1)%self.capacity
+        self.ptr[m]=ptr
+        self.body[m,ptr]=cells
+        self.occupancy[m,cells]=True
+        #loop detection over the last loop_window head cells
+        slot=self.steps[m]%self.loop_window
+        full=self.steps[m]>=self.loop_window
+        self.visits[m[full],self.recent[m[full],slot[full]]]-=1
+        self.recent[m,slot]=cells
+        self.visits[m,cells]+=1
+        looping=self.visits[m,cells]>self.loop_threshold
+        self.steps[m]+=1
+        ate=cells==self.apples[m]
+        shrink=m[~ate]
+        tails=self.body[shrink,(self.ptr[shrink]-self.lengths[shrink])%self.capacity]
+        self.occupancy[shrink,tails]=False
+        self.steps_since_apple[shrink]+=1
+        grow=m[ate]
+        if len(grow):
+            self.lengths[grow]+=1
+            self.scores[grow]+=1
+            self.steps_since_apple[grow]=0
+            self.place_apples(grow)
+        if self.early_stop:
+            stagnating=self.steps_since_apple[m]>=self.apple_timeout
+            self.alive[m[looping|stagnating]]=False
+            self.causes[m[stagnating]]=STAGNATION
+            self.causes[m[looping]]=LOOP
+        self.state[idx]=self.get_state(idx)
+        return self.state,self.alive.copy(),self.scores.copy()
@@ -0,0 +1,257 @@
+"""speed benchmarks for the engine, the network and whole generations
+
+python benchmark.py                           run everything, print a table
+python benchmark.py --json out.json           also write the results as json
+python benchmark.py --baseline out.json       fail if anything got slower
+python benchmark.py --only step forward       run a subset
+"""
+import sys
+import json
+import time
+import timeit
+import random
+import argparse
+import itertools
+import platform
+import subprocess
+import numpy as np
+from collections import deque
+from snake_game import snakegame
+from neural_network import neuralnetwork
+
+
+def hamiltonian_cycle(width,height):
+    """cells of a cycle through every cell of the board (height must be even)"""
+    cycle=[(x,0) for x in range(width)]
+    for y in range(1,height):
+        xs=range(width-1,0,-1) if y%2 else range(1,width)
+        cycle.extend((x,y) for x in xs)
+    cycle.extend((0,y) for y in range(height-1,0,-1))
+    return cycle
+
+
+def bench_step(lengths=(3,100,400,800),steps=5000,width=30,height=30,repeat=3):
+    """snakegame.step cost at several snake lengths (best of repeat runs)
+
+    the snake follows a hamiltonian cycle so it never dies; it may grow by a
+    few cells when it runs over apples
+    """
+    cycle=hamiltonian_cycle(width,height)
+    nxt={cycle[i]:cycle[(i+1)%len(cycle)] for i in range(len(cycle))}
+    codes={(0,-1):0,(0,1):1,(-1,0):2,(1,0):3}
+    results={}
+    for length in lengths:
+        elapsed=float("inf")
+        for _ in range(repeat):
+            game=snakegame(width,height)
+            body=[cycle[(length-1-i)%len(cycle)] for i in range(length)]
+            head,neck=body[0],cycle[(length-2)%len(cycle)]
+            game.set_body(body,(head[0]-neck[0],head[1]-neck[1]))
+            game.place_apple()
+            start=time.perf_counter()
+            for _ in range(steps):
+                head=game.snake[0]
+                to=nxt[head]
+                game.step(codes[(to[0]-head[0],to[1]-head[1])])
+            elapsed=min(elapsed,time.perf_counter()-start)
+        results[length]={"steps_per_sec":steps/elapsed,"us_per_step":elapsed/steps*1e6,
+                         "final_length":len(game.snake)}
+    return results
+
+
+def bench_decision(number=20000):
+    """per-decision latency of neuralnetwork.get_action vs its frozen policy"""
+    brain=neuralnetwork()
+    policy=brain.freeze()
+    state=snakegame().reset()
+    state32=np.array(state,dtype=np.float32)
+    results={}
+    for name,fn in (("neuralnetwork",lambda:brain.get_action(state)),
+                    ("frozen",lambda:policy.get_action(state)),
+                    ("frozen_float32",lambda:policy.get_action(state32))):
+        elapsed=min(timeit.repeat(fn,number=number,repeat=5))
+        results[name]={"us_per_decision":elapsed/number*1e6,"decisions_per_sec":number/elapsed}
+    return results
+
+
+def bench_get_state(number=20000):
+    """snakegame.get_state cost, without and with vision rays
+
+    the head moves between every call, like in a game (statebuffer skips
+    unchanged features, so an idle game would only time its compares);
+    get_state_unchanged is that idle case
+    """
+    results={}
+    for name,vision in (("get_state",False),("get_state_vision",True),("get_state_unchanged",False)):
+        game=snakegame(vision=vision)
+        game.reset()
+        x,y=game.snake[0]
+        bodies=(deque([(x,y)]),deque([(x+1,y)]))
+        if name=="get_state_unchanged":
+            bodies=bodies[:1]
+        moves=itertools.cycle(bodies)
+        def call():
+            game.snake=next(moves)
+            return game.get_state()
+        elapsed=min(timeit.repeat(call,number=number,repeat=5))
+        results[name]={"us_per_call":elapsed/number*1e6,"calls_per_sec":number/elapsed}
+    return results
+
+
+def bench_forward(number=20000):
+    """neuralnetwork.forward decisions/sec"""
+    brain=neuralnetwork()
+    state=snakegame().reset()
+    elapsed=min(timeit.repeat(lambda:brain.forward(state),number=number,repeat=5))
+    return {"forward":{"us_per_decision":elapsed/number*1e6,"decisions_per_sec":number/elapsed}}
+
+
+def bench_genetic_ops(number=200):
+    """neuralnetwork.mutate and crossover time"""
+    a=neuralnetwork()
+    b=neuralnetwork()
+    results={}
+    for name,fn in (("mutate",lambda:a.copy().mutate(rate=0.02)),
+                    ("crossover",lambda:neuralnetwork.crossover(a,b))):
+        elapsed=min(timeit.repeat(fn,number=number,repeat=5))
+        results[name]={"us_per_call":elapsed/number*1e6,"calls_per_sec":number/elapsed}
+    return results
+
+
+def bench_reproduce(pop_sizes=(1000,100000),repeat=3):
+    """selection + reproduction of the genome matrix population (best of repeat)"""
+    from population import genomepopulation
+    results={}
+    for pop_size in pop_sizes:
+        np.random.seed(0)
+        population=genomepopulation.random(pop_size,(14,16,16,4))
+        elapsed=float("inf")
+        for _ in range(repeat):
+            population.fitness=np.random.rand(pop_size)
+            start=time.perf_counter()
+            parents=population.select(pop_size//2)
+            population=population.reproduce(parents.order,pop_size)
+            elapsed=min(elapsed,time.perf_counter()-start)
+        results[pop_size]={"ms":elapsed*1000,"generations_per_sec":1/elapsed,
+                           "matrix_mb":population.genomes.nbytes/2**20}
+    return results
+
+
+def bench_evolve(pop_sizes=(50,500,5000),generations=2):
+    """full geneticalgorithm.evolve generations/sec"""
+    from genetic_algorithm import geneticalgorithm
+    results={}
+    for pop_size in pop_sizes:
+        random.seed(0)
+        np.random.seed(0)
+        ga=geneticalgorithm(pop_size=pop_size)
+        start=time.perf_counter()
+        for _ in range(generations):
+            ga.evolve()
+        elapsed=time.perf_counter()-start
+        ga.close()
+        results[pop_size]={"sec_per_generation":elapsed/generations,"generations_per_sec":generations/elapsed}
+    return results
+
+
+def bench_import(modules=("main","genetic_algorithm","evaluation"),repeat=5):
+    """cold import time of the headless entry points (fresh interpreter per run)
+
+    pygame_loaded should stay 0: training and pool workers must not pull in SDL
+    """
+    code=("import sys,time;t=time.perf_counter();import {};"
+          "print(time.perf_counter()-t,int('pygame' in sys.modules))")
+    results={}
+    for module in modules:
+        best=float("inf")
+        for _ in range(repeat):
+            out=subprocess.run([sys.executable,"-c",code.format(module)],capture_output=True,text=True,check=True).stdout.split()
+            best=min(best,float(out[0]))
+        results[module]={"ms":best*1000,"pygame_loaded":int(out[1])}
+    return results
+
+
+BENCHMARKS={
+    "step":bench_step,
+    "get_state":bench_get_state,
+    "forward":bench_forward,
+    "decision":bench_decision,
+    "genetic_ops":bench_genetic_ops,
+    "reproduce":bench_reproduce,
+    "evolve":bench_evolve,
+    "import":bench_import,
+}
+
+#quicker settings for --quick
+QUICK={
+    "step":{"steps":1000},
+    "get_state":{"number":2000},
+    "forward":{"number":2000},
+    "decision":{"number":2000},
+    "genetic_ops":{"number":20},
+    "reproduce":{"pop_sizes":(1000,10000)},
+    "evolve":{"pop_sizes":(50,500),"generations":1},
+    "import":{"repeat":2},
+}
+
+
+def flatten(results,prefix=""):
+    """{"a":{"b":1}} -> {"a.b":1}"""
+    flat={}
+    for key,value in results.items():
+        name=f"{prefix}{key}"
+        if isinstance(value,dict):
+            flat.update(flatten(value,name+"."))
+        else:
+            flat[name]=value
+    return flat
+
+
+def compare(results,baseline,tolerance):
+    """throughput metrics (*_per_sec) that fell more than tolerance below baseline"""
+    current=flatten(results)
+    regressions=[]
+    for name,old in flatten(baseline).items():
+        if not name.endswith("_per_sec") or name not in current or old<=0:
+            continue
+        change=current[name]/old-1
+        if change<-tolerance:
+            regressions.append((name,old,current[name],change))
+    return regressions
+
+
+def main():
+    parser=argparse.ArgumentParser(description="snake ai benchmarks")
+    parser.add_argument("--only",nargs="+",choices=sorted(BENCHMARKS),help="benchmarks to run (default: all)")
+    parser.add_argument("--quick",action="store_true",help="fewer iterations and no 5000-agent generation")
+    parser.add_argument("--json",metavar="FILE",help="write results as json")
+    parser.add_argument("--baseline",metavar="FILE",help="json from an earlier run to compare against")
+    parser.add_argument("--tolerance",type=float,default=0.2,help="allowed throughput drop vs baseline (default 0.2 = 20%%)")
+    args=parser.parse_args()
+
+    results={}
+    for name in args.only or BENCHMARKS:
+        options=QUICK[name] if args.quick else {}
+        results[name]=BENCHMARKS[name](**options)
+        for key,value in flatten(results[name]).items():
+            print(f"{name+'.'+key:48s} {value:14.2f}")
+    report={"meta":{"python":platform.python_version(),"numpy":np.__version__,
+                    "machine":platform.machine(),"time":time.time()},
+            "results":results}
+    if args.json:
+        with open(args.json,"w") as f:
+            json.dump(report,f,indent=2)
+        print(f"results written to {args.json}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline=json.load(f)["results"]
+        regressions=compare(results,baseline,args.tolerance)
+        for name,old,new,change in regressions:
+            print(f"REGRESSION {name}: {old:.2f} -> {new:.2f} ({change:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions beyond {args.tolerance:.0%} vs {args.baseline}")
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,281 @@
+"""weights checkpoints
+
+binary format (little endian), version 1:
+    header   magic "SNKW", version u2, array count u2, data offset u4,
+             fitness f8, generation u8
+    arrays   per array: name 8s, dtype 4s (numpy dtype.str), rows u4,
+             cols u4, offset u8
+    data     raw C-order arrays, each starting on a 64 byte boundary
+
+the layer shapes live in the header, so the file can be memory-mapped and
+any network size loads without hard-coded offsets. the old text format
+(trained_weights.txt) can still be read and written. full training
+snapshots (population, fitnesses, rng states) use the same format.
+"""
+import os
+import struct
+import threading
+import atexit
+import numpy as np
+from neural_network import neuralnetwork
+
+MAGIC=b"SNKW"
+VERSION=1
+DEFAULT_WEIGHTS="trained_weights.bin"
+TEXT_WEIGHTS="trained_weights.txt"
+DEFAULT_SNAPSHOT="snapshot.bin"
+
+_HEADER=struct.Struct("<4sHHIdQ")
+_ARRAY=struct.Struct("<8s4sIIQ")
+_ALIGN=64
+
+
+def _align(n):
+    return -(-n//_ALIGN)*_ALIGN
+
+
+def _atomic_write(filename,write):
+    """write to a temp file next to filename, then rename over it"""
+    tmp=f"{filename}.tmp"
+    with open(tmp,"wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp,filename)
+
+
+def _brain_from(arrays):
+    w1,w2,w3=arrays["w1"],arrays["w2"],arrays["w3"]
+    brain=neuralnetwork(w1.shape[0],w1.shape[1],w2.shape[1],w3.shape[1])
+    for name,value in arrays.items():
+        setattr(brain,name,value)
+    return brain
+
+
+def _save_arrays(filename,arrays,fitness=0,generation=0):
+    """atomically write named 2d arrays in the checkpoint format"""
+    offset=_align(_HEADER.size+_ARRAY.size*len(arrays))
+    entries=[]
+    for name,a in arrays:
+        entries.append((name,a,offset))
+        offset=_align(offset+a.nbytes)
+    def write(f):
+        f.write(_HEADER.pack(MAGIC,VERSION,len(arrays),entries[0][2],float(fitness),int(generation)))
+        for name,a,pos in entries:
+            f.write(_ARRAY.pack(name.encode(),a.dtype.str.encode(),a.shape[0],a.shape[1],pos))
+        for name,a,pos in entries:
+            f.write(b"\0"*(pos-f.tell()))
+            f.write(a.tobytes())
+    _atomic_write(filename,write)
+
+
+def _load_arrays(filename,mmap=True):
+    """named arrays and {"fitness":..,"generation":..} of a checkpoint format file"""
+    with open(filename,"rb") as f:
+        magic,version,count,_,fitness,generation=_HEADER.unpack(f.read(_HEADER.size))
+        if magic!=MAGIC:
+            raise ValueError(f"{filename} is not a weights checkpoint")
+        if version>VERSION:
+            raise ValueError(f"{filename} has checkpoint version {version}, newest supported is {VERSION}")
+        entries=[_ARRAY.unpack(f.read(_ARRAY.size)) for _ in range(count)]
+    arrays={}
+    for name,dtype,rows,cols,offset in entries:
+        name=name.rstrip(b"\0").decode()
+        dtype=np.dtype(dtype.rstrip(b"\0").decode())
+        if mmap:
+            arrays[name]=np.memmap(filename,dtype=dtype,mode="r",offset=offset,shape=(rows,cols))
+        else:
+            arrays[name]=np.fromfile(filename,dtype=dtype,count=rows*cols,offset=offset).reshape(rows,cols)
+    return arrays,{"fitness":fitness,"generation":generation}
+
+
+def save_checkpoint(brain,filename=DEFAULT_WEIGHTS,fitness=0,generation=0,dtype=np.float32):
+    """atomically write brain as a binary checkpoint"""
+    arrays=[(name,np.ascontiguousarray(getattr(brain,name),dtype=dtype)) for name,_ in brain.shapes()]
+    _save_arrays(filename,arrays,fitness,generation)
+
+
+def is_checkpoint(filename):
+    with open(filename,"rb") as f:
+        return f.read(4)==MAGIC
+
+
+def load_checkpoint(filename=DEFAULT_WEIGHTS,mmap=True):
+    """read a binary checkpoint; returns (brain,{"fitness":..,"generation":..})
+
+    with mmap the weight arrays are read-only views of the file
+    """
+    arrays,meta=_load_arrays(filename,mmap)
+    if "w1" not in arrays:
+        raise ValueError(f"{filename} holds no weights (is it a training snapshot?)")
+    return _brain_from(arrays),meta
+
+
+def save_snapshot(state,filename=DEFAULT_SNAPSHOT):
+    """atomically write the full training state (see geneticalgorithm.snapshot)
+
+    stored in the checkpoint format: the population as one float32 genome
+    matrix, its fitnesses, the layer sizes and both rng states
+    """
+    version,py_keys,py_gauss=state["random_state"]
+    _,np_keys,np_pos,np_has_gauss,np_gauss=state["numpy_state"]
+    eval_seed=state["eval_seed"]
+    arrays=[
+        ("genomes",np.ascontiguousarray(state["genomes"],dtype="<f4")),
+        ("fitness",np.asarray(state["fitness"],dtype="<f8").reshape(-1,1)),
+        ("sizes",np.asarray(state["sizes"],dtype="<i8").reshape(1,-1)),
+        ("pyrng",np.asarray(py_keys,dtype="<u4").reshape(1,-1)),
+        ("nprng",np.asarray(np_keys,dtype="<u4").reshape(1,-1)),
+        #eval_seed+1 (0=none), numpy rng position and gauss flag, random's gauss flag
+        ("state",np.array([[0 if eval_seed is None else eval_seed+1,np_pos,np_has_gauss,py_gauss is not None]],dtype="<u8")),
+        ("gauss",np.array([[np_gauss,py_gauss or 0.0]],dtype="<f8")),
+    ]
+    _save_arrays(filename,arrays,state["best_fitness"],state["generation"])
+
+
+def load_snapshot(filename=DEFAULT_SNAPSHOT):
+    """inverse of save_snapshot; returns the state dict"""
+    arrays,meta=_load_arrays(filename,mmap=False)
+    if "genomes" not in arrays:
+        raise ValueError(f"{filename} is not a training snapshot")
+    eval_seed,np_pos,np_has_gauss,py_has_gauss=(int(v) for v in arrays["state"][0])
+    np_gauss,py_gauss=(float(v) for v in arrays["gauss"][0])
+    return {
+        "genomes":arrays["genomes"],
+        "fitness":arrays["fitness"][:,0],
+        "sizes":tuple(int(v) for v in arrays["sizes"][0]),
+        "generation":meta["generation"],
+        "best_fitness":meta["fitness"],
+        "eval_seed":eval_seed-1 if eval_seed else None,
+        "random_state":(3,tuple(int(v) for v in arrays["pyrng"][0]),py_gauss if py_has_gauss else None),
+        "numpy_state":("MT19937",arrays["nprng"][0].astype(np.uint32),np_pos,np_has_gauss,np_gauss),
+    }
+
+
+def save_text_weights(brain,filename=TEXT_WEIGHTS):
+    """write brain in the original comma separated text format"""
+    def write(f):
+        for name,_ in brain.shapes():
+            f.write(f"{name}:\n".encode())
+            for row in getattr(brain,name):
+                f.write((",".join(map(str,row))+"\n").encode())
+    _atomic_write(filename,write)
+
+
+def load_text_weights(filename=TEXT_WEIGHTS):
+    """read the text format; returns a brain or None if the layout is unknown"""
+    sections={}
+    name=None
+    with open(filename,"r") as f:
+        for line in f:
+            line=line.strip()
+            if not line:
+                continue
+            if line.endswith(":"):
+                name=line[:-1]
+                sections[name]=[]
+            elif name is not None:
+                sections[name].append(list(map(float,line.split(","))))
+    arrays={k:np.array(v) for k,v in sections.items()}
+    if all(k in arrays for k in ("w1","b1","w2","b2","w3","b3")):
+        return _brain_from(arrays)
+    if "w3" not in arrays and arrays.get("w1") is not None and arrays["w1"].shape[0]==13:
+        #old format - 13 inputs, one hidden layer (16x4), pad to 14 and restructure
+        hidden=arrays["w1"].shape[1]
+        brain=neuralnetwork(input_size=14,hidden_size1=hidden,hidden_size2=hidden,output_size=arrays["w2"].shape[1])
+        #pad 14th input (apple_distance)
+        brain.w1=np.vstack([arrays["w1"],np.zeros((1,hidden))])
+        brain.b1=arrays["b1"]
+        #initialize new w2 as identity-like mapping (hidden1 to hidden2)
+        brain.w2=np.eye(hidden)*0.1+np.random.randn(hidden,hidden)*0.05
+        brain.b2=np.zeros((1,hidden))
+        #old w2/b2 (hidden to output) become w3/b3
+        brain.w3=arrays["w2"]
+        brain.b3=arrays["b2"]
+        return brain
+    return None
+
+
+def load_weights(filename=None):
+    """load weights from a binary checkpoint or a text file
+
+    without a filename the default checkpoint is tried first, then the text
+    file. returns None if nothing usable is found
+    """
+    candidates=[filename] if filename else [DEFAULT_WEIGHTS,TEXT_WEIGHTS]
+    for path in candidates:
+        if not os.path.exists(path):
+            continue
+        if is_checkpoint(path):
+            brain,meta=load_checkpoint(path)
+            print(f"weights loaded from {path} (generation {meta['generation']}, fitness {meta['fitness']:.0f})")
+            return brain
+        brain=load_text_weights(path)
+        if brain is None:
+            print(f"incompatible weight format in {path}")
+            return None
+        print(f"weights loaded from {path}")
+        return brain
+    print(f"no existing weights found at {' or '.join(candidates)}")
+    return None
+
+
+def save_weights(brain,filename=DEFAULT_WEIGHTS,fitness=0,generation=0):
+    """save as text if filename ends in .txt, otherwise as a binary checkpoint"""
+    if filename.endswith(".txt"):
+        save_text_weights(brain,filename)
+    else:
+        save_checkpoint(brain,filename,fitness,generation)
+
+
+class checkpointwriter:
+    """writes checkpoints on a background thread
+
+    only the newest pending save per file is kept, so a slow disk never
+    makes the caller wait and never builds up a backlog of stale checkpoints
+    """
+
+    def __init__(self):
+        self.cond=threading.Condition()
+        self.pending={}
+        self.busy=False
+        self.thread=None
+        atexit.register(self.flush)
+
+    def submit(self,brain,filename=DEFAULT_WEIGHTS,fitness=0,generation=0):
+        self.schedule(filename,save_weights,brain.copy(),filename,fitness,generation)
+
+    def schedule(self,filename,write,*args):
+        """run write(*args) on the writer thread, replacing a pending write to filename
+
+        args must not change afterwards (pass copies)
+        """
+        with self.cond:
+            self.pending[filename]=(write,args)
+            if self.thread is None:
+                self.thread=threading.Thread(target=self._run,daemon=True)
+                self.thread.start()
+            self.cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                filename,(write,args)=self.pending.popitem()
+                self.busy=True
+            try:
+                write(*args)
+            except Exception as e:
+                #keep the thread alive, or later saves and flush() would wait forever
+                print(f"could not save {filename}: {e!r}")
+            finally:
+                with self.cond:
+                    self.busy=False
+                    self.cond.notify_all()
+
+    def flush(self):
+        """block until every submitted checkpoint is on disk"""
+        with self.cond:
+            while self.pending or self.busy:
+                self.cond.wait()
@@ -0,0 +1,252 @@
+import os
+import signal
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory,resource_tracker
+import numpy as np
+from batch_snake_game import BatchSnakeEnv,mix64,STEP_CAP,CAUSES
+from population_network import populationnetwork
+
+
+def episode_seeds(base_seed,n):
+    """schedule of n apple seeds derived from one base seed"""
+    idx=np.arange(n,dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        return mix64(np.uint64(base_seed)+idx*np.uint64(0x9e3779b97f4a7c15))
+
+
+def play(net,seeds,max_steps=1000,**env_options):
+    """play every agent of net on its episodes in lockstep
+
+    seeds is (P,) for one episode per agent or (P,K) for K episodes each;
+    all P*K games run as one batch. returns (scores,steps,causes) shaped
+    like seeds; steps counts the move that killed the snake, like the
+    serial loop in geneticalgorithm.evaluate, and causes holds the
+    batch_snake_game death cause codes. env_options go to BatchSnakeEnv
+    (board size, early stop thresholds)
+    """
+    seeds=np.asarray(seeds,dtype=np.uint64)
+    p=net.size
+    k=seeds.size//p
+    env=BatchSnakeEnv(p*k,seeds=seeds.reshape(-1),**env_options)
+    steps=np.zeros(p*k,dtype=np.int64)
+    actions=np.zeros((p,k),dtype=np.int32)
+    active=np.arange(p)
+    for _ in range(max_steps):
+        alive=env.alive
+        live=np.flatnonzero(alive.reshape(p,k).any(axis=1))
+        if len(live)==0:
+            break
+        #drop agents with no game left from the forward pass once half are done
+        if len(live)<=len(active)//2:
+            net=net.subset(np.searchsorted(active,live))
+            active=live
+        actions[active]=net.get_actions(env.state.reshape(p,k,-1)[active])
+        steps[alive]+=1
+        env.step(actions.reshape(-1))
+    causes=np.where(env.alive,STEP_CAP,env.causes)
+    return env.scores.reshape(seeds.shape).copy(),steps.reshape(seeds.shape),causes.reshape(seeds.shape)
+
+
+def play_genome(genome,sizes,seeds,max_steps=1000,evaluator=None,**env_options):
+    """(scores,steps,causes) of one flat genome on every seed of a 1d schedule
+
+    with an evaluator the episodes are split into rows of the same genome so
+    they spread over its workers; every episode only depends on its seed,
+    so the results don't depend on the split
+    """
+    seeds=np.asarray(seeds,dtype=np.uint64)
+    n=len(seeds)
+    rows=max(1,min(n,getattr(evaluator,"workers",1)*4)) if evaluator is not None else 1
+    k=-(-n//rows)
+    #pad the last row with copies of the last seed, their results are dropped
+    seeds=np.concatenate([seeds,np.repeat(seeds[-1:],rows*k-n)]).reshape(rows,k)
+    genomes=np.repeat(np.asarray(genome)[None],rows,axis=0)
+    if evaluator is not None:
+        results=evaluator.evaluate(genomes,seeds,sizes,max_steps,env_options)
+    else:
+        results=play(populationnetwork.from_genomes(genomes,*sizes),seeds,max_steps,**env_options)
+    return tuple(r.reshape(-1)[:n] for r in results)
+
+
+#percentiles of episode_report
+PERCENTILES=(5,25,50,75,95)
+
+
+def episode_report(scores,steps,causes):
+    """score distribution, episode lengths and death causes of 1d per-episode results"""
+    values,counts=np.unique(scores,return_counts=True)
+    return {
+        "episodes":int(len(scores)),
+        "score":{
+            "mean":float(scores.mean()),
+            "std":float(scores.std()),
+            "min":int(scores.min()),
+            "max":int(scores.max()),
+            "percentiles":{str(p):float(v) for p,v in zip(PERCENTILES,np.percentile(scores,PERCENTILES))},
+            "distribution":{str(v):int(c) for v,c in zip(values.tolist(),counts.tolist())},
+        },
+        "length":{
+            "mean":float(steps.mean()),
+            "percentiles":{str(p):float(v) for p,v in zip(PERCENTILES,np.percentile(steps,PERCENTILES))},
+        },
+        "deaths":{name:int(n) for name,n in zip(CAUSES[1:],np.bincount(causes,minlength=len(CAUSES))[1:])},
+    }
+
+
+def paired_report(scores_a,scores_b):
+    """b against a on the same seeds: mean score difference and per-episode wins"""
+    diff=np.asarray(scores_b,dtype=np.float64)-scores_a
+    stderr=diff.std(ddof=1)/np.sqrt(len(diff)) if len(diff)>1 else 0.0
+    return {
+        "mean_diff":float(diff.mean()),
+        "stderr":float(stderr),
+        "b_better":int((diff>0).sum()),
+        "tied":int((diff==0).sum()),
+        "a_better":int((diff<0).sum()),
+    }
+
+
+def summarize(values,how="mean"):
+    """reduce (P,K) per-episode values to one number per agent
+
+    how is "mean", "min", "median" or a quantile in [0,1]
+    """
+    if how=="mean":
+        return values.mean(axis=1)
+    if how=="min":
+        return values.min(axis=1)
+    if how=="median":
+        return np.median(values,axis=1)
+    return np.quantile(values,float(how),axis=1)
+
+
+def fitness(scores,steps):
+    #fitness=score*10000+survival bonus
+    return scores*10000+steps
+
+
+class fitnesscache:
+    """size-bounded LRU of per-episode results keyed by genome and seeds
+
+    with deterministic seeded episodes a genome replays exactly the same
+    games, so its (scores,steps,causes) can be reused instead of re-simulated
+    """
+
+    def __init__(self,capacity=10000):
+        self.capacity=capacity
+        self.entries=OrderedDict()
+
+    @staticmethod
+    def key(genome,seeds):
+        h=hashlib.blake2b(digest_size=16)
+        h.update(np.ascontiguousarray(genome).tobytes())
+        h.update(np.ascontiguousarray(seeds,dtype=np.uint64).tobytes())
+        return h.digest()
+
+    def get(self,key):
+        value=self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self,key,value):
+        self.entries[key]=value
+        self.entries.move_to_end(key)
+        while len(self.entries)>self.capacity:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+#per-worker cache of attached shared memory blocks
+_attached={}
+
+
+def _attach(name):
+    if name not in _attached:
+        #the parent replaced its block, let go of the old one
+        for old in _attached.values():
+            old.close()
+        _attached.clear()
+        _attached[name]=shared_memory.SharedMemory(name=name)
+    return _attached[name]
+
+
+def _init_worker():
+    #forked workers inherit the trainer's save-on-signal handlers; ctrl+c is
+    #handled by the parent and terminate() must just stop the worker
+    signal.signal(signal.SIGINT,signal.SIG_IGN)
+    signal.signal(signal.SIGTERM,signal.SIG_DFL)
+
+
+def _evaluate_chunk(task):
+    name,shape,dtype,start,end,seeds,sizes,max_steps,env_options=task
+    shm=_attach(name)
+    genomes=np.ndarray(shape,dtype=dtype,buffer=shm.buf)
+    chunk=np.array(genomes[start:end])
+    net=populationnetwork.from_genomes(chunk,*sizes)
+    return (start,)+play(net,seeds,max_steps,**env_options)
+
+
+class parallelevaluator:
+    """spreads fitness evaluation over a process pool
+
+    genomes go to the workers through one shared memory block instead of
+    being pickled per task; every chunk carries its rows of the explicit
+    seed schedule, so results don't depend on the worker count
+    """
+
+    def __init__(self,workers=None,chunk_size=None):
+        self.workers=workers or os.cpu_count() or 1
+        self.chunk_size=chunk_size
+        self.pool=None
+        self.shm=None
+
+    def _buffer(self,shape,dtype):
+        nbytes=int(np.prod(shape))*np.dtype(dtype).itemsize
+        if self.shm is None or self.shm.size<nbytes:
+            self._release()
+            self.shm=shared_memory.SharedMemory(create=True,size=nbytes)
+        return np.ndarray(shape,dtype=dtype,buffer=self.shm.buf)
+
+    def evaluate(self,genomes,seeds,sizes=(14,16,16,4),max_steps=1000,env_options=None):
+        """(scores,steps,causes) for every row of a (P,n_params) genome matrix
+
+        seeds is (P,) or (P,K) as for play()
+        """
+        if self.pool is None:
+            #workers must share the parent's resource tracker, otherwise each
+            #one starts its own and unlinks the block when it exits
+            resource_tracker.ensure_running()
+            self.pool=ProcessPoolExecutor(self.workers,initializer=_init_worker)
+        n=len(genomes)
+        shared=self._buffer(genomes.shape,genomes.dtype)
+        shared[:]=genomes
+        chunk=self.chunk_size or max(1,-(-n//(self.workers*4)))
+        tasks=[(self.shm.name,genomes.shape,genomes.dtype.str,start,min(start+chunk,n),seeds[start:start+chunk],sizes,max_steps,env_options or {})
+               for start in range(0,n,chunk)]
+        seeds=np.asarray(seeds,dtype=np.uint64)
+        scores=np.zeros(seeds.shape,dtype=np.int64)
+        steps=np.zeros(seeds.shape,dtype=np.int64)
+        causes=np.zeros(seeds.shape,dtype=np.int8)
+        for start,chunk_scores,chunk_steps,chunk_causes in self.pool.map(_evaluate_chunk,tasks):
+            end=start+len(chunk_scores)
+            scores[start:end]=chunk_scores
+            steps[start:end]=chunk_steps
+            causes[start:end]=chunk_causes
+        return scores,steps,causes
+
+    def _release(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm=None
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool=None
+        self._release()
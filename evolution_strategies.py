@@ -0,0 +1,197 @@
+"""evolution strategies (openai-es style) over the same network parameters
+
+instead of a population of genomes, es keeps one parameter vector theta.
+every generation it plays pop_size/2 antithetic pairs theta+-sigma*eps on
+the same seeded episodes, where each eps is a slice of one big table of
+gaussian noise in shared memory: a perturbation is just its offset into the
+table, so workers get offsets and send back returns, whatever the network
+size. returns are rank-shaped and adam moves theta along the weighted sum
+of the noise slices. theta itself is the agent that gets saved, through the
+same checkpoint path as geneticalgorithm, so `main.py play` runs it.
+"""
+import random
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory,resource_tracker
+import numpy as np
+from neural_network import neuralnetwork
+from agent import snakeagent
+from population_network import populationnetwork
+from evaluation import episode_seeds,play,fitness,summarize,_init_worker
+from checkpoint import checkpointwriter
+from state_encoder import state_size
+from trainer import trainer,episode_stats
+
+DEFAULT_NOISE=2**24  #floats in the noise table (64MB)
+
+
+def centered_ranks(values):
+    """ranks scaled to [-0.5,0.5]; ties get the order they appear in"""
+    flat=values.ravel()
+    ranks=np.empty(flat.size)
+    ranks[np.argsort(flat,kind="stable")]=np.arange(flat.size)
+    return (ranks/max(flat.size-1,1)-0.5).reshape(values.shape)
+
+
+class adam:
+    """adam step sizes for gradient ascent"""
+
+    def __init__(self,size,learning_rate=0.01,beta1=0.9,beta2=0.999,epsilon=1e-8):
+        self.learning_rate=learning_rate
+        self.beta1=beta1
+        self.beta2=beta2
+        self.epsilon=epsilon
+        self.m=np.zeros(size)
+        self.v=np.zeros(size)
+        self.t=0
+
+    def step(self,gradient):
+        self.t+=1
+        self.m=self.beta1*self.m+(1-self.beta1)*gradient
+        self.v=self.beta2*self.v+(1-self.beta2)*gradient*gradient
+        a=self.learning_rate*np.sqrt(1-self.beta2**self.t)/(1-self.beta1**self.t)
+        return a*self.m/(np.sqrt(self.v)+self.epsilon)
+
+
+def perturbed_returns(theta,noise,offsets,sigma,seeds,sizes,max_steps,env_options):
+    """play theta+sigma*eps and theta-sigma*eps for every noise offset
+
+    returns (scores,steps,causes) shaped (2,len(offsets),episodes), plus
+    and minus rows first, all on the same episode seeds
+    """
+    n=len(theta)
+    eps=np.stack([noise[i:i+n] for i in offsets])*sigma
+    genomes=np.concatenate([theta+eps,theta-eps])
+    net=populationnetwork.from_genomes(genomes,*sizes)
+    seeds=np.broadcast_to(seeds,(len(genomes),len(seeds)))
+    return tuple(r.reshape(2,len(offsets),-1) for r in play(net,seeds,max_steps,**env_options))
+
+
+#per-worker cache of attached shared memory blocks (noise table and theta)
+_blocks={}
+
+
+def _block(name,dtype,count):
+    if name not in _blocks:
+        _blocks[name]=shared_memory.SharedMemory(name=name)
+    return np.ndarray(count,dtype=dtype,buffer=_blocks[name].buf)
+
+
+def _evaluate_offsets(task):
+    noise_name,noise_size,theta_name,n_params,offsets,sigma,seeds,sizes,max_steps,env_options=task
+    noise=_block(noise_name,np.float32,noise_size)
+    theta=_block(theta_name,np.float64,n_params)
+    return perturbed_returns(theta,noise,offsets,sigma,seeds,sizes,max_steps,env_options)
+
+
+class evolutionstrategy(trainer):
+    def __init__(self,pop_size=100,sigma=0.05,learning_rate=0.01,l2=0.005,episodes=1,fitness_summary="mean",
+                 workers=None,noise_size=DEFAULT_NOISE,noise_seed=0,vision=False):
+        #pop_size/2 antithetic pairs are played every generation
+        self.pairs=max(1,pop_size//2)
+        self.pop_size=2*self.pairs
+        self.sigma=sigma
+        self.l2=l2  #weight decay on theta
+        self.episodes=episodes
+        self.fitness_summary=fitness_summary
+        self.max_steps=1000
+        self.env_options={"early_stop":True,"vision":vision}
+        self.sizes=(state_size(vision),16,16,4)
+        self.theta=neuralnetwork(*self.sizes).get_params()
+        self.optimizer=adam(len(self.theta),learning_rate)
+        self.workers=workers
+        self.pool=None
+        #the noise table lives in shared memory so pool workers read the same
+        #offsets without a copy each; it only depends on noise_seed
+        self.noise_shm=shared_memory.SharedMemory(create=True,size=noise_size*4)
+        self.noise=np.ndarray(noise_size,dtype=np.float32,buffer=self.noise_shm.buf)
+        rng=np.random.default_rng(noise_seed)
+        for start in range(0,noise_size,2**20):
+            end=min(start+2**20,noise_size)
+            self.noise[start:end]=rng.standard_normal(end-start,dtype=np.float32)
+        self.theta_shm=shared_memory.SharedMemory(create=True,size=len(self.theta)*8)
+        self.shared_theta=np.ndarray(len(self.theta),dtype=np.float64,buffer=self.theta_shm.buf)
+        self.generation=0
+        self.best=None
+        self.writer=checkpointwriter()
+        self.stats=None
+        self.callbacks=[]
+        #no --record-top, but main.py's loop checks for recordings
+        self.recordings=[]
+
+    def layer_sizes(self):
+        return self.sizes
+
+    def evaluate(self,offsets,seeds):
+        """(scores,steps,causes) of every antithetic pair, (2,pairs,episodes)"""
+        if not self.workers:
+            return perturbed_returns(self.theta,self.noise,offsets,self.sigma,seeds,self.sizes,
+                                     self.max_steps,self.env_options)
+        if self.pool is None:
+            resource_tracker.ensure_running()
+            self.pool=ProcessPoolExecutor(self.workers,initializer=_init_worker)
+        self.shared_theta[:]=self.theta
+        chunk=max(1,-(-len(offsets)//(self.workers*2)))
+        tasks=[(self.noise_shm.name,len(self.noise),self.theta_shm.name,len(self.theta),offsets[start:start+chunk],
+                self.sigma,seeds,self.sizes,self.max_steps,self.env_options) for start in range(0,len(offsets),chunk)]
+        parts=list(self.pool.map(_evaluate_offsets,tasks))
+        return tuple(np.concatenate([part[i] for part in parts],axis=1) for i in range(3))
+
+    def evolve(self):
+        self.stats={"generation":self.generation,"phases":{}}
+        n=len(self.theta)
+        with self.phase("evaluate"):
+            seeds=episode_seeds(random.getrandbits(63),self.episodes)
+            offsets=np.random.randint(0,len(self.noise)-n+1,size=self.pairs)
+            scores,steps,causes=self.evaluate(offsets,seeds)
+            #theta itself on the same episodes, for saving and reporting
+            net=populationnetwork.from_genomes(self.theta[None],*self.sizes)
+            center=play(net,seeds[None],self.max_steps,**self.env_options)
+        brain=neuralnetwork(*self.sizes)
+        brain.set_params(self.theta)
+        self.best=snakeagent(brain)
+        self.best.fitness=self.summarize(center[0],center[1])[0].item()
+        returns=self.summarize(scores,steps)
+        #the update makes the next generation, so it is timed (and logged in
+        #metrics.PHASES) as reproduce
+        with self.phase("reproduce"):
+            #rank shaping: only the order of the returns matters
+            weights=centered_ranks(returns)
+            gradient=np.zeros(n)
+            for w,i in zip((weights[0]-weights[1]).tolist(),offsets.tolist()):
+                gradient+=w*self.noise[i:i+n]
+            gradient/=returns.size
+            self.theta=self.theta+self.optimizer.step(gradient-self.l2*self.theta)
+        self.record_stats(returns,scores,steps,causes,center)
+        self.generation+=1
+        for callback in self.callbacks:
+            callback(self,self.stats)
+
+    def summarize(self,scores,steps):
+        """(...,episodes) results -> one fitness per agent"""
+        values=fitness(scores,steps)
+        if values.shape[-1]>1:
+            return summarize(values.reshape(-1,values.shape[-1]),self.fitness_summary).reshape(values.shape[:-1])
+        return values[...,0]
+
+    def record_stats(self,returns,scores,steps,causes,center):
+        k=scores.shape[-1]
+        simulated=int(steps.sum()+center[1].sum())
+        self.stats.update({
+            "best_fitness":self.best.fitness,
+            "mean_fitness":float(returns.mean()),
+            "median_fitness":float(np.median(returns)),
+        })
+        self.stats.update(episode_stats(scores.reshape(-1,k),steps.reshape(-1,k),causes.reshape(-1,k),simulated,
+                                        self.stats["phases"]["evaluate"]))
+
+    def close(self):
+        """finish pending saves, stop the workers and free the shared memory"""
+        self.writer.flush()
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool=None
+        for shm in (self.noise_shm,self.theta_shm):
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+        self.noise_shm=self.theta_shm=None
@@ -1,88 +1,318 @@
+import os
 import random
+import cProfile
 import numpy as np
-from neural_network import neuralnetwork
-from agent import snakeagent
 from snake_game import snakegame
+from population_network import populationnetwork
+from population import genomepopulation
+from evaluation import episode_seeds,play,fitness,summarize,parallelevaluator,fitnesscache
+from checkpoint import checkpointwriter,save_snapshot,load_snapshot,DEFAULT_SNAPSHOT
+from batch_snake_game import CAUSES,STEP_CAP
+from recording import record_episodes
+from state_encoder import state_size
+from trainer import trainer,episode_stats
 
 
-class geneticalgorithm:
-    def __init__(self,pop_size=100):
+def format_stats(stats):
+    """one line summary of geneticalgorithm.stats"""
+    phases=" ".join(f"{name}={t*1000:.0f}ms" for name,t in stats["phases"].items())
+    deaths=" ".join(f"{name}={n}" for name,n in stats["deaths"].items() if n)
+    line=(f"{phases} | {stats['simulated_steps']} steps ({stats['steps_per_sec']:.0f}/s)"
+          f" | mean length {stats['mean_episode_length']:.1f} | deaths {deaths}")
+    racing=stats.get("racing")
+    if racing:
+        agents="/".join(str(rung["agents"]) for rung in racing["rungs"])
+        line+=f" | racing {agents} agents, {racing['budget_saved']:.0%} of step budget saved"
+    return line
+
+
+class geneticalgorithm(trainer):
+    def __init__(self,pop_size=100,batched=True,workers=None,episodes=1,fitness_summary="mean",
+                 reseed_every=5,cache_size=10000,profile_every=0,profile_dir="profiles",evaluator=None,
+                 record_top=0,vision=False,racing=None):
         self.pop_size=pop_size
-        self.population=[]
+        #every agent plays the same `episodes` apple seeds (common random
+        #numbers), drawn anew every `reseed_every` generations (until then
+        #the elites copied forward hit the fitness cache); fitness_summary
+        #reduces them to one value
+        self.episodes=episodes
+        self.fitness_summary=fitness_summary
+        self.reseed_every=reseed_every
+        self.eval_seed=None
+        #results of genomes already played on the current seed schedule
+        #(with this ga's max_steps and env_options)
+        self.cache=fitnesscache(cache_size) if cache_size else None
+        self.cache_hits=0
+        self.cache_misses=0
+        self.batched=batched  #step the whole population in lockstep
+        #opt-in multi-core evaluation over a process pool, or any backend
+        #with the same evaluate() (e.g. remote_eval.remoteevaluator)
+        self.evaluator=evaluator or (parallelevaluator(workers) if workers else None)
+        #optional racing.racingscheduler: short budgets first, the full
+        #evaluation only for the agents that stay ahead
+        self.racing=racing
+        self.max_steps=1000  #limit steps to prevent infinite loops
+        #end episodes early when an agent loops or stops finding apples
+        #vision adds 8-direction wall/body/apple rays to the network inputs
+        self.env_options={"early_stop":True,"vision":vision}
         self.generation=0
-        for _ in range(pop_size):
-            brain=neuralnetwork()
-            self.population.append(snakeagent(brain))
+        self.writer=checkpointwriter()  #saves run off the evolve loop
+        #per-generation instrumentation, see evolve()
+        self.stats=None
+        self.callbacks=[]
+        self.profile_every=profile_every  #cProfile every Nth generation (0=off)
+        self.profile_dir=profile_dir
+        #episodes of the top record_top agents, re-played with their actions
+        #recorded after each evaluation (see recording.py)
+        self.record_top=record_top
+        self.recordings=[]
+        #one float32 (pop_size,n_params) genome matrix; indexing it gives
+        #agents whose brains are views into their row
+        self.population=genomepopulation.random(pop_size,(state_size(vision),16,16,4))
 
     
     def evaluate(self):
-        for agent in self.population:
-            game=snakegame()
-            state=game.reset()
-            steps=0
-            max_steps=1000  #limit steps to prevent infinite loops
-            while steps<max_steps:
-                action=agent.get_action(state)
-                state,alive,score=game.step(action)
-                steps+=1
-                if not alive:
-                    break
-            #fitness=score*10000+survival bonus
-            agent.fitness=score*10000+steps
+        if self.eval_seed is None or self.generation%self.reseed_every==0:
+            self.eval_seed=random.getrandbits(63)
+        seeds=self.episode_seeds()
+        genomes=self.genomes()
+        self.played=None
+        self.racing_report=None
+        if self.racing is not None:
+            self.evaluate_racing(genomes,seeds)
+        else:
+            self.evaluate_cached(genomes,seeds)
+        if self.record_top:
+            top=np.argsort(-self.fitnesses,kind="stable")[:self.record_top]
+            self.recordings=record_episodes(genomes[top],seeds[top],self.layer_sizes(),self.max_steps,
+                                            self.fitnesses[top],**self.env_options)
 
+    def evaluate_cached(self,genomes,seeds):
+        """full evaluation of every agent, reusing cached results"""
+        scores=np.zeros(seeds.shape,dtype=np.int64)
+        steps=np.zeros(seeds.shape,dtype=np.int64)
+        causes=np.zeros(seeds.shape,dtype=np.int8)
+        #only play genomes the cache hasn't seen on this schedule; identical
+        #genomes in one generation (elite copies, duplicate children) play once
+        todo={}
+        keys=[None]*len(genomes)
+        for i,genome in enumerate(genomes):
+            if self.cache is not None:
+                keys[i]=self.cache.key(genome,seeds[i])
+                cached=self.cache.get(keys[i])
+                if cached is not None:
+                    scores[i],steps[i],causes[i]=cached
+                    continue
+                todo.setdefault(keys[i],[]).append(i)
+            else:
+                todo[i]=[i]
+        first=np.array([idx[0] for idx in todo.values()],dtype=np.int64)
+        self.cache_misses=len(first)
+        self.cache_hits=len(genomes)-len(first)
+        self.simulated_steps=0
+        if len(first):
+            results=self.play(first,genomes,seeds)
+            self.simulated_steps=int(results[1].sum())
+            for idx,s,n,c in zip(todo.values(),*results):
+                scores[idx]=s
+                steps[idx]=n
+                causes[idx]=c
+                if self.cache is not None:
+                    self.cache.put(keys[idx[0]],(s,n,c))
+        self.results=(scores,steps,causes)
+        self.set_fitness(scores,steps)
 
+    def evaluate_racing(self,genomes,seeds):
+        """successive halving over self.racing's rungs (see racing.py)
+
+        short rungs don't give full results, so the fitness cache is skipped
+        """
+        def play(idx,seeds,max_steps):
+            return self.play(idx,genomes,seeds,max_steps)
+        values,self.results,self.played,self.racing_report=self.racing.run(play,seeds,self.max_steps,self.fitness_summary)
+        self.cache_hits=0
+        self.cache_misses=len(genomes)
+        self.simulated_steps=self.racing_report["simulated_steps"]
+        self.assign_fitness(values)
+
+    def episode_seeds(self):
+        """(pop_size,episodes) apple seeds, the same row for every agent"""
+        schedule=episode_seeds(self.eval_seed,self.episodes)
+        return np.broadcast_to(schedule,(len(self.population),self.episodes))
+
+    def play(self,idx,genomes,seeds,max_steps=None):
+        """(scores,steps,causes) of agents idx on their rows of seeds
+
+        on the evaluator if there is one, else batched or serial; max_steps
+        defaults to self.max_steps
+        """
+        max_steps=max_steps or self.max_steps
+        if self.evaluator is not None:
+            return self.evaluate_parallel(idx,genomes,seeds,max_steps)
+        if self.batched:
+            return self.evaluate_batch(idx,genomes,seeds,max_steps)
+        return self.evaluate_serial(idx,seeds,max_steps)
+
+    def evaluate_serial(self,idx,seeds,max_steps):
+        """play agents idx one game at a time; returns (scores,steps,causes)"""
+        scores=np.zeros((len(idx),seeds.shape[1]),dtype=np.int64)
+        all_steps=np.zeros((len(idx),seeds.shape[1]),dtype=np.int64)
+        causes=np.zeros((len(idx),seeds.shape[1]),dtype=np.int8)
+        for row,i in enumerate(idx):
+            agent=self.population[i]
+            game=snakegame(seed=int(seeds[i,0]),**self.env_options)
+            for k,seed in enumerate(seeds[i]):
+                state=game.reset(seed=int(seed))
+                steps=0
+                score=0
+                while steps<max_steps:
+                    action=agent.get_action(state)
+                    state,alive,score=game.step(action)
+                    steps+=1
+                    if not alive:
+                        break
+                scores[row,k]=score
+                all_steps[row,k]=steps
+                causes[row,k]=CAUSES.index(game.death_cause) if not alive else STEP_CAP
+        return scores,all_steps,causes
+
+    def evaluate_batch(self,idx,genomes,seeds,max_steps):
+        """play all episodes of agents idx at once on a BatchSnakeEnv"""
+        net=populationnetwork.from_genomes(genomes[idx],*self.layer_sizes())
+        return play(net,seeds[idx],max_steps,**self.env_options)
+
+    def evaluate_parallel(self,idx,genomes,seeds,max_steps):
+        """evaluate chunks of agents idx on the worker pool"""
+        return self.evaluator.evaluate(genomes[idx],seeds[idx],self.layer_sizes(),max_steps,self.env_options)
+
+    def layer_sizes(self):
+        return self.population.sizes
+
+    def set_fitness(self,scores,steps):
+        """per-episode (P,K) results -> agent.fitness"""
+        values=fitness(scores,steps)
+        if values.shape[1]>1:
+            values=summarize(values,self.fitness_summary)
+        else:
+            values=values[:,0]
+        self.assign_fitness(values)
+
+    def assign_fitness(self,values):
+        """(P,) fitnesses -> agent.fitness"""
+        self.fitnesses=values
+        self.population.fitness=values
+
+    def genomes(self):
+        """population as a (pop_size,n_params) matrix of flat genomes (not a copy)"""
+        return self.population.genomes
+
+    def close(self):
+        """finish pending saves and shut down the worker pool, if any"""
+        self.writer.flush()
+        if self.evaluator is not None:
+            self.evaluator.close()
 
-    
     def selection(self):
-        self.population.sort(key=lambda a:a.fitness,reverse=True)
-        return self.population[:self.pop_size//2]
+        """top half by fitness, best first, as a view of the population"""
+        return self.population.select(self.pop_size//2)
     
     def reproduce(self,parents):
-        new_pop=[]
-        #elitism:keep top5
-        for p in parents[:5]:
-            new_pop.append(snakeagent(p.brain.copy()))
-        #fill w/children
-        while len(new_pop)<self.pop_size:
-            p1=random.choice(parents)
-            p2=random.choice(parents)
-            child_brain=neuralnetwork.crossover(p1.brain,p2.brain)
-            child_brain.mutate(rate=0.02)
-            new_pop.append(snakeagent(child_brain))
-        self.population=new_pop
+        #elitism:keep top5, fill w/children (uniform crossover + mutation),
+        #each a single pass over the genome matrix
+        self.population=self.population.reproduce(parents.order,self.pop_size,elites=5,rate=0.02)
 
 
     
     def evolve(self):
-        self.evaluate()
+        profiler=None
+        if self.profile_every and self.generation%self.profile_every==0:
+            profiler=cProfile.Profile()
+            profiler.enable()
+        self.stats={"generation":self.generation,"phases":{}}
+        with self.phase("evaluate"):
+            self.evaluate()
         self.best=self.get_best()
-        parents=self.selection()
-        self.reproduce(parents)
+        with self.phase("selection"):
+            parents=self.selection()
+        #ranked survivors, best first (e.g. for island migration)
+        self.parents=parents
+        with self.phase("reproduce"):
+            self.reproduce(parents)
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(self.profile_dir,exist_ok=True)
+            profiler.dump_stats(os.path.join(self.profile_dir,f"gen_{self.generation:06d}.prof"))
+        self.record_stats()
         self.generation+=1
-    
+        for callback in self.callbacks:
+            callback(self,self.stats)
+
+    def record_stats(self):
+        scores,steps,causes=self.results
+        self.stats.update({
+            "best_fitness":self.best.fitness,
+            "mean_fitness":float(self.fitnesses.mean()),
+            "median_fitness":float(np.median(self.fitnesses)),
+            "cache_hits":self.cache_hits,
+            "cache_misses":self.cache_misses,
+        })
+        #with racing only the episodes an agent got to play count
+        self.stats.update(episode_stats(scores,steps,causes,self.simulated_steps,self.stats["phases"]["evaluate"],
+                                        self.played))
+        if self.racing_report is not None:
+            self.stats["racing"]=self.racing_report
+
     def get_best(self):
-        return max(self.population,key=lambda a:a.fitness)
+        return self.population.best()
     
-    def save_weights(self,filename="trained_weights.txt"):
-        """save best weights to file"""
-        if not hasattr(self,'best') or self.best is None:
-            return
-
-        brain=self.best.brain
-        with open(filename,"w") as f:
-            f.write("w1:\n")
-            for row in brain.w1:
-                f.write(",".join(map(str,row))+"\n")
-            f.write("b1:\n")
-            f.write(",".join(map(str,brain.b1[0]))+"\n")
-            f.write("w2:\n")
-            for row in brain.w2:
-                f.write(",".join(map(str,row))+"\n")
-            f.write("b2:\n")
-            f.write(",".join(map(str,brain.b2[0]))+"\n")
-            f.write("w3:\n")
-            for row in brain.w3:
-                f.write(",".join(map(str,row))+"\n")
-            f.write("b3:\n")
-            f.write(",".join(map(str,brain.b3[0]))+"\n")
-        print(f"Generation {self.generation}: weights saved to {filename} (fitness={self.best.fitness})")
+    def snapshot(self):
+        """copy of everything needed to continue this run exactly
+
+        the genomes are copied too: reproduce() reuses the population
+        buffer, and the snapshot may still be waiting to be written. fitness
+        is that of the stored genomes, all zeros between generations since
+        the children are only played by the next evolve()
+        """
+        best=getattr(self,"best",None)
+        return {
+            "genomes":self.genomes().copy(),
+            "fitness":self.population.fitness.copy(),
+            "sizes":self.layer_sizes(),
+            "generation":self.generation,
+            "best_fitness":best.fitness if best is not None else 0,
+            "eval_seed":self.eval_seed,
+            "random_state":random.getstate(),
+            "numpy_state":np.random.get_state(),
+        }
+
+    def save_snapshot(self,filename=DEFAULT_SNAPSHOT,wait=False):
+        """write the full training state in the background (atomically)
+
+        taken between generations, resume() continues as if the run had
+        never stopped
+        """
+        self.writer.schedule(filename,save_snapshot,self.snapshot(),filename)
+        if wait:
+            self.writer.flush()
+
+    def resume(self,filename=DEFAULT_SNAPSHOT):
+        """restore population, fitnesses, generation and rng states from a snapshot
+
+        returns False (and leaves the fresh run as it is) if there is no
+        snapshot yet, e.g. when a run is stopped before its first one
+        """
+        if not os.path.exists(filename):
+            print(f"no snapshot found at {filename}, starting a new run")
+            return False
+        state=load_snapshot(filename)
+        self.population=genomepopulation(state["genomes"],state["sizes"],state["fitness"])
+        self.pop_size=len(self.population)
+        #the snapshot's input size decides whether its agents see rays
+        self.env_options["vision"]=state["sizes"][0]==state_size(True)
+        self.fitnesses=state["fitness"]
+        self.generation=state["generation"]
+        self.eval_seed=state["eval_seed"]
+        random.setstate(state["random_state"])
+        np.random.set_state(state["numpy_state"])
+        print(f"resumed from {filename} at generation {self.generation}")
+        return True
@@ -0,0 +1,147 @@
+"""island model: several populations evolving in their own processes
+
+every island runs its own geneticalgorithm.evolve loop; every
+migrate_every generations the islands report their top genomes and the
+coordinator sends each island the migrants of its neighbours on the chosen
+topology. islands only talk at migration time, so they scale with the
+number of cores and keep their own lineages alive
+"""
+import os
+import random
+import multiprocessing as mp
+import numpy as np
+from neural_network import neuralnetwork
+from agent import snakeagent
+from genetic_algorithm import geneticalgorithm
+from evaluation import _init_worker
+from checkpoint import checkpointwriter,DEFAULT_WEIGHTS
+
+TOPOLOGIES=("ring","full")
+
+
+def migration_sources(n,topology="ring"):
+    """for every island, the islands whose migrants it receives"""
+    if topology=="ring":
+        return [[(i-1)%n] if n>1 else [] for i in range(n)]
+    if topology=="full":
+        return [[j for j in range(n) if j!=i] for i in range(n)]
+    raise ValueError(f"unknown topology {topology!r}, expected one of {TOPOLOGIES}")
+
+
+def immigrate(ga,genomes):
+    """replace the newest children of ga's population with migrant genomes"""
+    #the front of the population holds the elites, keep them
+    n=min(len(genomes),len(ga.population)-5)
+    if n>0:
+        ga.population.genomes[len(ga.population)-n:]=genomes[:n]
+
+
+def _run_island(index,seed,ga_options,migrate_every,migrants,inbox,results):
+    #ctrl+c is handled by the coordinator, terminate() just stops the island
+    _init_worker()
+    results.cancel_join_thread()
+    #forked islands would otherwise share the parent's random streams
+    random.seed(seed)
+    np.random.seed(seed%2**32)
+    ga=geneticalgorithm(**ga_options)
+    try:
+        while True:
+            history=[]
+            for _ in range(migrate_every):
+                ga.evolve()
+                history.append(ga.stats)
+            results.put({
+                "island":index,
+                "generation":ga.generation,
+                "fitness":ga.best.fitness,
+                "best":ga.best.brain.get_params(),
+                "sizes":ga.layer_sizes(),
+                "emigrants":ga.parents.genomes(migrants),
+                "stats":history,
+            })
+            incoming=inbox.get()
+            if incoming is None:
+                break
+            immigrate(ga,incoming)
+    finally:
+        ga.close()
+
+
+class islandmodel:
+    """coordinator for n islands of pop_size agents each
+
+    evolve() runs one migration epoch (migrate_every generations on every
+    island), then exchanges the top `migrants` genomes along the topology.
+    the global best is kept in self.best and saved through save_weights
+    like geneticalgorithm's; island_history holds every island's stats of
+    each generation of the last epoch, island_stats the latest of them
+    """
+
+    def __init__(self,islands=None,pop_size=50,migrate_every=10,migrants=2,topology="ring",**ga_options):
+        self.islands=islands or os.cpu_count() or 1
+        self.pop_size=pop_size
+        self.migrate_every=migrate_every
+        self.migrants=migrants
+        self.topology=topology
+        self.sources=migration_sources(self.islands,topology)
+        #options for each island's geneticalgorithm; islands are already
+        #one per core, so they evaluate in-process
+        self.ga_options=dict(ga_options,pop_size=pop_size,workers=None)
+        self.generation=0
+        self.best=None
+        self.island_stats=[None]*self.islands
+        self.island_history=[[] for _ in range(self.islands)]
+        self.island_fitness=[None]*self.islands
+        self.writer=checkpointwriter()
+        self.processes=[]
+
+    def start(self):
+        self.results=mp.Queue()
+        self.inboxes=[mp.Queue() for _ in range(self.islands)]
+        for i in range(self.islands):
+            args=(i,random.getrandbits(63),self.ga_options,self.migrate_every,self.migrants,self.inboxes[i],self.results)
+            process=mp.Process(target=_run_island,args=args)
+            process.start()
+            self.processes.append(process)
+
+    def evolve(self):
+        """one migration epoch on every island"""
+        if not self.processes:
+            self.start()
+        reports=[None]*self.islands
+        for _ in range(self.islands):
+            report=self.results.get()
+            reports[report["island"]]=report
+        for dest,sources in enumerate(self.sources):
+            incoming=[reports[src]["emigrants"] for src in sources]
+            self.inboxes[dest].put(np.concatenate(incoming) if incoming else np.empty((0,0)))
+        for i,report in enumerate(reports):
+            self.island_history[i]=report["stats"]
+            self.island_stats[i]=report["stats"][-1]
+            self.island_fitness[i]=report["fitness"]
+            if self.best is None or report["fitness"]>self.best.fitness:
+                brain=neuralnetwork(*report["sizes"])
+                brain.set_params(report["best"])
+                self.best=snakeagent(brain)
+                self.best.fitness=report["fitness"]
+        self.generation=reports[0]["generation"]
+
+    def save_weights(self,filename=DEFAULT_WEIGHTS,wait=False):
+        """save the best weights seen on any island (in the background)"""
+        if self.best is None:
+            return
+        self.writer.submit(self.best.brain,filename,self.best.fitness,self.generation)
+        if wait:
+            self.writer.flush()
+        print(f"Generation {self.generation}: weights saved to {filename} (fitness={self.best.fitness})")
+
+    def close(self):
+        """stop the islands and finish pending saves"""
+        self.writer.flush()
+        for inbox in getattr(self,"inboxes",[]):
+            inbox.put(None)
+        for process in self.processes:
+            process.join(timeout=60)
+            if process.is_alive():
+                process.terminate()
+        self.processes=[]
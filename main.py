@@ -1,57 +1,63 @@
-import pygame
-from neural_network import neuralnetwork
 from agent import snakeagent
 from snake_game import snakegame
+from checkpoint import load_weights,DEFAULT_SNAPSHOT,DEFAULT_WEIGHTS,TEXT_WEIGHTS
+from state_encoder import state_size
 
-from genetic_algorithm import geneticalgorithm
+from genetic_algorithm import geneticalgorithm,format_stats
+from evolution_strategies import evolutionstrategy
+from island import islandmodel,TOPOLOGIES
+from metrics import metricswriter,DEFAULT_METRICS
+from racing import racingscheduler,parse_schedule,DEFAULT_SCHEDULE
+from recording import save_recordings,load_recordings,episodereplayer,DEFAULT_RECORDINGS
+from evaluation import episode_seeds,play_genome,episode_report,paired_report,parallelevaluator,PERCENTILES
 
-def save_weights(brain,filename="weights.txt"):
-    with open(filename,"w") as f:
-        f.write("w1:\n")
-        for row in brain.w1:
-            f.write(",".join(map(str,row))+"\n")
-        f.write("b1:\n")
-        f.write(",".join(map(str,brain.b1[0]))+"\n")
-        f.write("w2:\n")
-        for row in brain.w2:
-            f.write(",".join(map(str,row))+"\n")
-        f.write("b2:\n")
-        f.write(",".join(map(str,brain.b2[0]))+"\n")
-    print(f"weights saved to {filename}")
-
-def load_weights(filename="trained_weights.txt"):
-    brain=neuralnetwork()
-    with open(filename,"r") as f:
-        lines=f.readlines()
-    #parse w1:6lines
-    idx=1
-    w1=[]
-    for i in range(6):
-        w1.append(list(map(float,lines[idx+i].strip().split(","))))
-    brain.w1=np.array(w1)
-    #parse b1:1line
-    idx=8
-    brain.b1=np.array([list(map(float,lines[idx].strip().split(",")))])
-    #parse w2:16lines
-    idx=10
-    w2=[]
-    for i in range(16):
-        w2.append(list(map(float,lines[idx+i].strip().split(","))))
-    brain.w2=np.array(w2)
-    #parse b2:1line
-    idx=27
-    brain.b2=np.array([list(map(float,lines[idx].strip().split(",")))])
-    print(f"weights loaded from {filename}")
-    return brain
-
-def train():
+def train(workers=None,episodes=1,fitness_summary="mean",reseed_every=5,profile_every=0,profile_dir="profiles",
+          islands=0,migrate_every=10,migrants=2,topology="ring",listen=None,
+          metrics=DEFAULT_METRICS,snapshot=DEFAULT_SNAPSHOT,snapshot_every=10,resume=False,
+          record_top=0,recordings=DEFAULT_RECORDINGS,vision=False,racing=None,optimizer="ga",sigma=0.05,
+          learning_rate=0.01):
+    import os
     import signal
-    import sys
-    ga=geneticalgorithm(pop_size=50)
+    #racing is a schedule of (max_steps,episodes,keep) rungs, see racing.py
+    racing=racingscheduler(racing) if racing else None
+    if optimizer=="es":
+        #one parameter vector moved by antithetic noise, see evolution_strategies.py;
+        #it has no population to snapshot
+        ga=evolutionstrategy(pop_size=100,sigma=sigma,learning_rate=learning_rate,episodes=episodes,
+                             fitness_summary=fitness_summary,workers=workers,vision=vision)
+        snapshot_every=0
+    elif islands:
+        #one population per island process, evolve() is one migration epoch
+        ga=islandmodel(islands,pop_size=50,migrate_every=migrate_every,migrants=migrants,topology=topology,
+                       episodes=episodes,fitness_summary=fitness_summary,reseed_every=reseed_every,vision=vision,
+                       racing=racing)
+        if snapshot_every:
+            print("island runs take no snapshots, --snapshot-every is ignored")
+            snapshot_every=0
+    else:
+        evaluator=None
+        if listen:
+            #fitness is evaluated by remote_eval.py workers that connect to this port
+            from remote_eval import remoteevaluator
+            evaluator=remoteevaluator(port=listen)
+            print(f"waiting for workers on port {listen}")
+        ga=geneticalgorithm(pop_size=50,workers=workers,episodes=episodes,fitness_summary=fitness_summary,
+                            reseed_every=reseed_every,profile_every=profile_every,profile_dir=profile_dir,
+                            evaluator=evaluator,record_top=record_top,vision=vision,racing=racing)
+        if resume:
+            resume=ga.resume(snapshot)
+    #one record per generation; islands get a log each (metrics_island0.bin, ...)
+    if islands:
+        root,ext=os.path.splitext(metrics)
+        logs=[metricswriter(f"{root}_island{i}{ext}") for i in range(islands)]
+    else:
+        #a resumed run continues its log, a new run starts a new one
+        logs=[metricswriter(metrics,resume=ga.generation if resume else None)]
     def signal_handler(sig,frame):
+        #unwind to the except below instead of saving from inside the
+        #handler, which could fire mid-evaluation while the pool is busy
         print("\nInterrupt received! Saving weights...")
-        ga.save_weights("trained_weights.txt")
-        sys.exit(0)
+        raise KeyboardInterrupt
     signal.signal(signal.SIGINT,signal_handler)
     signal.signal(signal.SIGTERM,signal_handler)
     #start continuous training
@@ -60,22 +66,53 @@ def train():
     try:
         while True:
             ga.evolve()
-            print(f"gen {ga.generation}: best fitness={ga.best.fitness}")
-            ga.save_weights("trained_weights.txt")
+            if islands:
+                print(f"gen {ga.generation}: best fitness={ga.best.fitness}")
+                for i,stats in enumerate(ga.island_stats):
+                    print(f"  island {i}: best fitness={ga.island_fitness[i]} | {format_stats(stats)}")
+                    for record in ga.island_history[i]:
+                        logs[i].append(record)
+                ga.save_weights()
+                continue
+            line=f"gen {ga.generation}: best fitness={ga.best.fitness}"
+            if optimizer=="ga":
+                line+=f" (cache hits={ga.cache_hits}, misses={ga.cache_misses})"
+            print(line)
+            ga.save_weights()
+            print(f"  {format_stats(ga.stats)}")
+            logs[0].append(ga.stats)
+            if ga.recordings:
+                #latest generation's top episodes, replay with `main.py replay`
+                ga.writer.schedule(recordings,save_recordings,ga.recordings,recordings)
+            #full state for --resume, every snapshot_every generations
+            if snapshot_every and ga.generation%snapshot_every==0:
+                ga.save_snapshot(snapshot)
     except KeyboardInterrupt:
         #user stopped training
         print("\nstopped.")
-        ga.save_weights("trained_weights.txt")
+        ga.save_weights(wait=True)
+        if snapshot_every:
+            ga.save_snapshot(snapshot,wait=True)
         print("saved.")
+    finally:
+        ga.close()
+        for log in logs:
+            log.close()
 
 def play_best():
+    import pygame
     pygame.init()
     #bigger window for 30x30 grid (450x450) + some padding
     screen=pygame.display.set_mode((500,500))
     pygame.display.set_caption("ai snake")
-    brain=load_weights("trained_weights.txt")
-    agent=snakeagent(brain)
-    game=snakegame()
+    brain=load_weights()
+    if brain is None:
+        pygame.quit()
+        return
+    #weights trained with --vision take the 38 ray inputs
+    vision=brain.input_size==state_size(True)
+    agent=snakeagent(brain).freeze()
+    game=snakegame(vision=vision)
     state=game.reset()
     clock=pygame.time.Clock()
     running=True
@@ -95,9 +132,134 @@ def play_best():
             state=game.reset()
     pygame.quit()
 
+def replay(filename=DEFAULT_RECORDINGS,episode=0,start=0):
+    """watch a recorded episode, starting at step `start`"""
+    import pygame
+    recording=load_recordings(filename)[episode]
+    print(recording)
+    replayer=episodereplayer(recording,early_stop=True)
+    pygame.init()
+    screen=pygame.display.set_mode((500,500))
+    pygame.display.set_caption("ai snake - replay")
+    clock=pygame.time.Clock()
+    for game in replayer.frames(start):
+        if any(event.type==pygame.QUIT for event in pygame.event.get()):
+            break
+        screen.fill((0,0,0))
+        game.render(screen,25,25)
+        pygame.display.flip()
+        clock.tick(10)
+    pygame.quit()
+
+def format_report(name,report):
+    """text lines for one evaluation.episode_report"""
+    score=report["score"]
+    length=report["length"]
+    pct=lambda values:"  ".join(f"p{p} {values[str(p)]:.0f}" for p in PERCENTILES)
+    deaths=" ".join(f"{cause}={n}" for cause,n in report["deaths"].items() if n)
+    distribution=" ".join(f"{v}:{n}" for v,n in score["distribution"].items())
+    return [f"{name}: {report['episodes']} episodes in {report['seconds']:.1f}s",
+            f"  score    mean {score['mean']:.2f} (std {score['std']:.2f})  min {score['min']}  {pct(score['percentiles'])}  max {score['max']}",
+            f"  length   mean {length['mean']:.1f}  {pct(length['percentiles'])}",
+            f"  deaths   {deaths}",
+            f"  scores   {distribution}"]
+
+def evaluate_weights(filenames=None,episodes=1000,seed=0,max_steps=1000,workers=None,json_path=None):
+    """play seeded headless episodes with saved weights and report the results
+
+    with two files both play the very same episodes and the report adds a
+    paired comparison. returns the report dict, or None if weights are missing
+    """
+    import os
+    import json
+    import time
+    seeds=episode_seeds(seed,episodes)
+    evaluator=parallelevaluator(workers) if workers else None
+    report={"seed":seed,"episodes":episodes,"max_steps":max_steps,"weights":[]}
+    scores=[]
+    try:
+        for filename in filenames or [None]:
+            path=filename or next((p for p in (DEFAULT_WEIGHTS,TEXT_WEIGHTS) if os.path.exists(p)),DEFAULT_WEIGHTS)
+            brain=load_weights(path)
+            if brain is None:
+                return None
+            sizes=(brain.input_size,brain.hidden_size1,brain.hidden_size2,brain.output_size)
+            start=time.perf_counter()
+            #the plain game rules (no early stop), as in play mode
+            results=play_genome(brain.get_params(),sizes,seeds,max_steps,evaluator,
+                                vision=brain.input_size==state_size(True))
+            entry=dict(episode_report(*results),file=path,seconds=time.perf_counter()-start)
+            report["weights"].append(entry)
+            scores.append(results[0])
+            print("\n".join(format_report(path,entry)))
+    finally:
+        if evaluator is not None:
+            evaluator.close()
+    if len(scores)==2:
+        paired=report["paired"]=paired_report(*scores)
+        a,b=(entry["file"] for entry in report["weights"])
+        print(f"{b} vs {a} on the same {episodes} seeds: mean score {paired['mean_diff']:+.2f} "
+              f"(stderr {paired['stderr']:.2f}), better in {paired['b_better']}, tied {paired['tied']}, "
+              f"worse in {paired['a_better']} episodes")
+    if json_path:
+        with open(json_path,"w") as f:
+            json.dump(report,f,indent=2)
+        print(f"report written to {json_path}")
+    return report
+
 if __name__=="__main__":
+    import argparse
     import sys
-    if len(sys.argv)>1 and sys.argv[1]=="play":
+    parser=argparse.ArgumentParser(description="snake ai - headless training or play")
+    parser.add_argument("mode",nargs="?",default="train",choices=["train","play","replay","eval"])
+    parser.add_argument("--workers",type=int,default=None,help="evaluate fitness on N processes (default: single process)")
+    parser.add_argument("--episodes",type=int,default=1,help="seeded episodes per agent each generation")
+    parser.add_argument("--fitness",default="mean",help="how episodes are combined: mean, min, median or a quantile like 0.25")
+    parser.add_argument("--reseed-every",type=int,default=5,help="generations between new apple seed schedules; in between, elites and duplicates reuse their cached fitness (1 turns that off)")
+    parser.add_argument("--listen",type=int,default=None,metavar="PORT",help="evaluate fitness on remote_eval.py workers connecting to PORT")
+    parser.add_argument("--islands",type=int,default=0,help="evolve N populations in parallel processes with migration (default: one population)")
+    parser.add_argument("--migrate-every",type=int,default=10,help="generations between island migrations")
+    parser.add_argument("--migrants",type=int,default=2,help="top genomes each island sends per migration")
+    parser.add_argument("--topology",default="ring",choices=TOPOLOGIES,help="which islands exchange migrants")
+    parser.add_argument("--metrics",default=DEFAULT_METRICS,help="per-generation metrics log (read it with metrics.metricsreader)")
+    parser.add_argument("--snapshot",default=DEFAULT_SNAPSHOT,help="full training state file (population, rng states)")
+    parser.add_argument("--snapshot-every",type=int,default=10,help="generations between snapshots, 0 disables them (a snapshot is also written on exit)")
+    parser.add_argument("--resume",action="store_true",help="continue the run saved in --snapshot")
+    parser.add_argument("--record-top",type=int,default=0,help="record the episodes of the top N agents every generation")
+    parser.add_argument("--recordings",default=DEFAULT_RECORDINGS,help="file for --record-top, read by replay")
+    parser.add_argument("--episode",type=int,default=0,help="replay: which recorded episode")
+    parser.add_argument("--step",type=int,default=0,help="replay: start at this step")
+    parser.add_argument("--weights",nargs="+",default=None,metavar="FILE",help="eval: checkpoint(s) to evaluate, two are compared on the same seeds")
+    parser.add_argument("--eval-episodes",type=int,default=1000,help="eval: seeded episodes per checkpoint")
+    parser.add_argument("--seed",type=int,default=0,help="eval: base seed of the episode schedule")
+    parser.add_argument("--max-steps",type=int,default=1000,help="eval: step cap per episode")
+    parser.add_argument("--json",metavar="FILE",help="eval: also write the report as json")
+    parser.add_argument("--vision",action="store_true",help="add 8-direction wall/body/apple rays to the network inputs")
+    parser.add_argument("--racing",nargs="?",type=parse_schedule,const=DEFAULT_SCHEDULE,default=None,metavar="SCHEDULE",
+                        help="successive halving: rungs of steps:episodes:keep before the full evaluation (default 100:1:0.5,300:1:0.5)")
+    parser.add_argument("--optimizer",default="ga",choices=["ga","es"],help="genetic algorithm or evolution strategies")
+    parser.add_argument("--sigma",type=float,default=0.05,help="es: std of the parameter noise")
+    parser.add_argument("--learning-rate",type=float,default=0.01,help="es: adam step size")
+    parser.add_argument("--profile-every",type=int,default=0,help="write a cProfile of every Nth generation (default: off)")
+    parser.add_argument("--profile-dir",default="profiles",help="where --profile-every puts its .prof files")
+    args=parser.parse_args()
+    if args.islands and (args.resume or args.workers or args.listen or args.record_top or args.profile_every):
+        parser.error("--islands does not support --resume, --workers, --listen, --record-top or --profile-every")
+    if args.optimizer=="es" and (args.resume or args.islands or args.listen or args.racing or args.record_top):
+        parser.error("--optimizer es does not support --resume, --islands, --listen, --racing or --record-top")
+    if args.weights and len(args.weights)>2:
+        parser.error("--weights takes one checkpoint, or two to compare")
+    if args.mode=="play":
         play_best()
+    elif args.mode=="eval":
+        if evaluate_weights(args.weights,args.eval_episodes,args.seed,args.max_steps,args.workers,args.json) is None:
+            sys.exit(1)
+    elif args.mode=="replay":
+        replay(args.recordings,args.episode,args.step)
     else:
-        train()
+        train(workers=args.workers,episodes=args.episodes,fitness_summary=args.fitness,reseed_every=args.reseed_every,
+              profile_every=args.profile_every,profile_dir=args.profile_dir,islands=args.islands,
+              migrate_every=args.migrate_every,migrants=args.migrants,topology=args.topology,listen=args.listen,
+              metrics=args.metrics,snapshot=args.snapshot,snapshot_every=args.snapshot_every,resume=args.resume,
+              record_top=args.record_top,recordings=args.recordings,vision=args.vision,
+              racing=args.racing,optimizer=args.optimizer,sigma=args.sigma,learning_rate=args.learning_rate)
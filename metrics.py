@@ -0,0 +1,131 @@
+"""append-only per-generation metrics log of one run
+
+file layout (little endian): a 64 byte header (magic "SNKM", version u2,
+record size u2, zero padding) followed by fixed size RECORD entries, one
+per generation. a record is only ever appended, so a crash can at most
+leave a partial last record, which readers ignore and writers cut off.
+the reader memory-maps the records, so slicing a run of millions of
+generations only touches the pages that are read
+"""
+import os
+import time
+import struct
+import numpy as np
+from batch_snake_game import CAUSES
+
+MAGIC=b"SNKM"
+VERSION=1
+DEFAULT_METRICS="metrics.bin"
+PHASES=("evaluate","selection","reproduce","save")
+QUANTILES=(0,0.25,0.5,0.75,1)
+
+_HEADER=struct.Struct("<4sHH")
+_HEADER_SIZE=64
+
+RECORD=np.dtype([
+    ("generation","<u8"),
+    ("time","<f8"),  #unix time the record was written
+    ("best_fitness","<f8"),
+    ("mean_fitness","<f8"),
+    ("median_fitness","<f8"),
+    ("score_quantiles","<f4",(len(QUANTILES),)),  #of the per-agent mean score
+    ("simulated_steps","<u8"),
+    ("episodes","<u4"),
+    ("mean_episode_length","<f4"),
+    ("deaths","<u4",(len(CAUSES)-1,)),  #per cause, CAUSES order without "alive"
+    ("phases","<f4",(len(PHASES),)),  #seconds, PHASES order
+])
+
+
+def _read_header(f,filename):
+    magic,version,size=_HEADER.unpack(f.read(_HEADER.size))
+    if magic!=MAGIC:
+        raise ValueError(f"{filename} is not a metrics log")
+    if version!=VERSION or size!=RECORD.itemsize:
+        raise ValueError(f"{filename} has metrics version {version} (record size {size}), expected {VERSION}")
+
+
+def make_record(stats):
+    """one RECORD from geneticalgorithm.stats"""
+    record=np.zeros((),dtype=RECORD)
+    record["generation"]=stats["generation"]
+    record["time"]=time.time()
+    for name in ("best_fitness","mean_fitness","median_fitness","simulated_steps","episodes","mean_episode_length"):
+        record[name]=stats[name]
+    record["score_quantiles"]=stats["score_quantiles"]
+    record["deaths"]=[stats["deaths"][name] for name in CAUSES[1:]]
+    record["phases"]=[stats["phases"].get(name,0.0) for name in PHASES]
+    return record
+
+
+class metricswriter:
+    """appends one record per generation; flushed after every record
+
+    a new run starts a new log (an old one is replaced); with
+    resume=generation the existing log is continued instead, minus any
+    records of that generation or later, written after the snapshot
+    """
+
+    def __init__(self,filename=DEFAULT_METRICS,resume=None):
+        self.filename=filename
+        if resume is not None and os.path.exists(filename) and os.path.getsize(filename)>0:
+            with open(filename,"r+b") as f:
+                _read_header(f,filename)
+                #drop a record cut short by a crash
+                n=(os.path.getsize(filename)-_HEADER_SIZE)//RECORD.itemsize
+                if n:
+                    generations=np.memmap(filename,dtype=RECORD,mode="r",offset=_HEADER_SIZE,shape=(n,))["generation"]
+                    n=int(np.searchsorted(generations,resume))
+                    del generations
+                f.truncate(_HEADER_SIZE+n*RECORD.itemsize)
+            self.file=open(filename,"ab")
+        else:
+            #unlink rather than truncate, a reader may still have the old log mapped
+            if os.path.exists(filename):
+                os.remove(filename)
+            self.file=open(filename,"wb")
+            self.file.write(_HEADER.pack(MAGIC,VERSION,RECORD.itemsize).ljust(_HEADER_SIZE,b"\0"))
+            self.file.flush()
+
+    def append(self,stats):
+        self.file.write(make_record(stats).tobytes())
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class metricsreader:
+    """read-only, memory-mapped view of a metrics log
+
+    reader[a:b:c] and column() return record slices without loading the
+    rest of the file; call refresh() to see records appended since
+    """
+
+    def __init__(self,filename=DEFAULT_METRICS):
+        self.filename=filename
+        with open(filename,"rb") as f:
+            _read_header(f,filename)
+        self.records=np.zeros(0,dtype=RECORD)
+        self.refresh()
+
+    def refresh(self):
+        """remap if the log grew; returns the number of records"""
+        n=(os.path.getsize(self.filename)-_HEADER_SIZE)//RECORD.itemsize
+        if n!=len(self.records):
+            self.records=np.memmap(self.filename,dtype=RECORD,mode="r",offset=_HEADER_SIZE,shape=(n,)) if n>0 else np.zeros(0,dtype=RECORD)
+        return n
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self,key):
+        return self.records[key]
+
+    def column(self,name,start=None,stop=None,step=None):
+        return self.records[name][start:stop:step]
+
+    def downsample(self,name,points=500):
+        """at most `points` evenly spaced values of a column, e.g. for a graph"""
+        step=max(1,-(-len(self.records)//points))
+        return self.column(name,step=step)
@@ -1,5 +1,11 @@
 import numpy as np
 
+def layer_shapes(input_size=14,hidden_size1=16,hidden_size2=16,output_size=4):
+    """(name,shape) of every parameter array, in flat genome order"""
+    return [("w1",(input_size,hidden_size1)),("b1",(1,hidden_size1)),
+            ("w2",(hidden_size1,hidden_size2)),("b2",(1,hidden_size2)),
+            ("w3",(hidden_size2,output_size)),("b3",(1,output_size))]
+
 class neuralnetwork:
     def __init__(self, input_size=14, hidden_size1=16, hidden_size2=16, output_size=4):
         #input: head_x, head_y, tail_x, tail_y, apple_x, apple_y, direction,
@@ -35,7 +41,7 @@ class neuralnetwork:
         return exp_x/np.sum(exp_x,axis=1,keepdims=True)
     
     def forward(self,x):
-        x=np.array(x).reshape(1,-1)
+        x=np.array(x,dtype=np.float64).reshape(1,-1)
         #input to hidden1
         self.z1=np.dot(x,self.w1)+self.b1
         self.a1=self.relu(self.z1)
@@ -53,19 +59,53 @@ class neuralnetwork:
         return np.argmax(output)
     
     def mutate(self,rate=0.1):
-        #mutation
-        def mut(val):
-            if np.random.rand()<rate:
-                return val+np.random.randn()*0.5
-            return val
-        self.w1=np.array([[mut(v) for v in row]for row in self.w1])
-        self.b1=np.array([[mut(v) for v in row]for row in self.b1])
-        self.w2=np.array([[mut(v) for v in row]for row in self.w2])
-        self.b2=np.array([[mut(v) for v in row]for row in self.b2])
-        self.w3=np.array([[mut(v) for v in row]for row in self.w3])
-        self.b3=np.array([[mut(v) for v in row]for row in self.b3])
+        #mutation: every value gets gaussian noise with probability rate
+        for name,shape in self.shapes():
+            hit=np.random.rand(*shape)<rate
+            setattr(self,name,getattr(self,name)+np.where(hit,np.random.randn(*shape)*0.5,0))
 
     
+    def freeze(self):
+        """read-only float32 copy for fast inference (play/demo)"""
+        return frozenpolicy(self)
+
+    def shapes(self):
+        return layer_shapes(self.input_size,self.hidden_size1,self.hidden_size2,self.output_size)
+
+    def param_count(self):
+        return sum(int(np.prod(shape)) for _,shape in self.shapes())
+
+    def get_params(self):
+        """all weights and biases as one flat genome vector"""
+        return np.concatenate([getattr(self,name).ravel() for name,_ in self.shapes()])
+
+    def set_params(self,params):
+        """load weights and biases from a flat genome vector"""
+        pos=0
+        for name,shape in self.shapes():
+            size=int(np.prod(shape))
+            setattr(self,name,np.array(params[pos:pos+size],dtype=np.float64).reshape(shape))
+            pos+=size
+
+    @staticmethod
+    def view(params,input_size=14,hidden_size1=16,hidden_size2=16,output_size=4):
+        """network whose weights and biases are views into a flat genome
+
+        writes to the arrays change params (e.g. a population matrix row);
+        mutate() and set_params() rebind them to new arrays instead
+        """
+        nn=object.__new__(neuralnetwork)
+        nn.input_size=input_size
+        nn.hidden_size1=hidden_size1
+        nn.hidden_size2=hidden_size2
+        nn.output_size=output_size
+        pos=0
+        for name,shape in nn.shapes():
+            size=int(np.prod(shape))
+            setattr(nn,name,params[pos:pos+size].reshape(shape))
+            pos+=size
+        return nn
+
     def copy(self):
         nn=neuralnetwork(self.input_size,self.hidden_size1,self.hidden_size2,self.output_size)
         nn.w1=self.w1.copy()
@@ -91,3 +131,44 @@ class neuralnetwork:
         child.b2=np.where(np.random.rand(1,p1.hidden_size2)<0.5,p1.b2,p2.b2)
         child.b3=np.where(np.random.rand(1,p1.output_size)<0.5,p1.b3,p2.b3)
         return child
+
+
+class frozenpolicy:
+    """immutable float32 snapshot of a neuralnetwork for picking actions
+
+    each bias is folded into its weight matrix as an extra input row that is
+    always 1, and every activation goes into a preallocated buffer, so
+    get_action is three dots and two relus and allocates nothing per call
+    when given a float32 array. softmax is skipped: it doesn't change the
+    argmax
+    """
+
+    def __init__(self,brain):
+        self.input_size=brain.input_size
+        self.hidden_size1=brain.hidden_size1
+        self.hidden_size2=brain.hidden_size2
+        self.output_size=brain.output_size
+        #[w;b] so that [x,1]@[w;b]==x@w+b
+        for w,b in (("w1","b1"),("w2","b2"),("w3","b3")):
+            a=np.ascontiguousarray(np.vstack([getattr(brain,w),getattr(brain,b)]),dtype=np.float32)
+            a.flags.writeable=False
+            setattr(self,w,a)
+        #scratch buffers reused by every call; the trailing 1 feeds the bias row
+        self._x=np.ones(self.input_size+1,dtype=np.float32)
+        self._h1=np.ones(self.hidden_size1+1,dtype=np.float32)
+        self._h2=np.ones(self.hidden_size2+1,dtype=np.float32)
+        self._out=np.empty(self.output_size,dtype=np.float32)
+        self._zeros1=np.zeros(self.hidden_size1,dtype=np.float32)
+        self._zeros2=np.zeros(self.hidden_size2,dtype=np.float32)
+        self._x_in=self._x[:-1]
+        self._h1_out=self._h1[:-1]
+        self._h2_out=self._h2[:-1]
+
+    def get_action(self,inputs):
+        self._x_in[:]=inputs
+        np.dot(self._x,self.w1,out=self._h1_out)
+        np.maximum(self._h1_out,self._zeros1,out=self._h1_out)
+        np.dot(self._h1,self.w2,out=self._h2_out)
+        np.maximum(self._h2_out,self._zeros2,out=self._h2_out)
+        np.dot(self._h2,self.w3,out=self._out)
+        return self._out.argmax()
@@ -0,0 +1,158 @@
+"""the ga population as one contiguous float32 genome matrix
+
+every agent is a row of a (pop_size,n_params) matrix in layer_shapes
+order, so selection, crossover and mutation are whole-matrix numpy
+operations instead of per-agent python loops; 100,000 agents of the
+default 14-16-16-4 network take 232MB per matrix. agents and brains
+handed out by indexing are views into their row
+"""
+import numpy as np
+from neural_network import neuralnetwork,layer_shapes
+from agent import snakeagent
+
+#rows per crossover block, keeps the gathered parent rows in cache-sized pieces
+_BLOCK=1024
+#byte -> 8 uint32 masks, all ones where the bit is set (msb first)
+_BIT_MASKS=(-np.unpackbits(np.arange(256,dtype=np.uint8)[:,None],axis=1).astype(np.int32)).view(np.uint32)
+
+
+class genomepopulation:
+    def __init__(self,genomes,sizes,fitness=None):
+        self.genomes=np.ascontiguousarray(genomes,dtype=np.float32)
+        self.sizes=tuple(sizes)
+        self.fitness=np.zeros(len(self.genomes)) if fitness is None else np.array(fitness,dtype=np.float64)
+        #reproduce() writes the next generation here and hands this buffer
+        #over, so rows of the previous generation stay valid until the next one
+        self.spare=None
+
+    @staticmethod
+    def random(pop_size,sizes):
+        """fresh population, initialized like neuralnetwork()"""
+        blocks=[]
+        for name,shape in layer_shapes(*sizes):
+            if name.startswith("w"):
+                blocks.append(np.random.randn(pop_size,int(np.prod(shape))).astype(np.float32)*np.float32(0.1))
+            else:
+                blocks.append(np.zeros((pop_size,int(np.prod(shape))),dtype=np.float32))
+        return genomepopulation(np.concatenate(blocks,axis=1),sizes)
+
+    def __len__(self):
+        return len(self.genomes)
+
+    def brain(self,i):
+        """neuralnetwork whose weights are views into row i"""
+        return neuralnetwork.view(self.genomes[i],*self.sizes)
+
+    def __getitem__(self,i):
+        if isinstance(i,slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        agent=snakeagent(self.brain(i))
+        agent.fitness=self.fitness[i].item()
+        return agent
+
+    def __setitem__(self,i,agent):
+        """copy an agent's weights and fitness into row i"""
+        self.genomes[i]=agent.brain.get_params()
+        self.fitness[i]=agent.fitness
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def best(self):
+        """detached copy of the fittest agent (first one on ties)"""
+        i=int(np.argmax(self.fitness))
+        agent=snakeagent(self.brain(i).copy())
+        agent.fitness=self.fitness[i].item()
+        return agent
+
+    def select(self,n):
+        """the n fittest agents, best first (stable on ties)"""
+        return rankedview(self,np.argsort(-self.fitness,kind="stable")[:n])
+
+    def reproduce(self,parents,pop_size,elites=5,rate=0.02,scale=0.5):
+        """next generation from the parent rows parents (best first)
+
+        the top `elites` parents are copied unchanged, every other row is a
+        uniform crossover of two random parents plus gaussian noise
+        (scale) on each parameter with probability rate
+        """
+        n_params=self.genomes.shape[1]
+        if self.spare is None or self.spare.shape!=(pop_size,n_params):
+            self.spare=np.empty((pop_size,n_params),dtype=np.float32)
+        new=self.spare
+        elites=min(elites,len(parents),pop_size)
+        new[:elites]=self.genomes[parents[:elites]]
+        children=new[elites:]
+        p1=parents[np.random.randint(0,len(parents),size=len(children))]
+        p2=parents[np.random.randint(0,len(parents),size=len(children))]
+        #uniform crossover as a bit select on the raw float bits:
+        #child=b^((a^b)&mask), with mask all ones where the value comes from a
+        bits=self.genomes.view(np.uint32)
+        out=children.view(np.uint32)
+        for start in range(0,len(children),_BLOCK):
+            end=min(start+_BLOCK,len(children))
+            size=(end-start)*n_params
+            #one random bit per parameter picks the parent
+            coins=np.frombuffer(np.random.bytes(-(-size//8)),dtype=np.uint8)
+            mask=_BIT_MASKS.take(coins,axis=0).reshape(-1)[:size].reshape(end-start,n_params)
+            a=bits[p1[start:end]]
+            b=bits[p2[start:end]]
+            np.bitwise_xor(a,b,out=a)
+            a&=mask
+            np.bitwise_xor(a,b,out=out[start:end])
+        mutate(children,rate,scale)
+        population=genomepopulation.__new__(genomepopulation)
+        population.genomes=new
+        population.sizes=self.sizes
+        population.fitness=np.zeros(pop_size)
+        population.spare=self.genomes if self.genomes.shape==new.shape else None
+        return population
+
+
+def mutate(genomes,rate=0.02,scale=0.5):
+    """add gaussian noise to each entry of genomes with probability rate, in place
+
+    the mutated positions come from geometric gaps between hits, so only
+    about rate*size random numbers are drawn instead of one per entry
+    """
+    flat=genomes.reshape(-1)
+    size=len(flat)
+    if not size or rate<=0:
+        return genomes
+    if rate>=1:
+        flat+=(np.random.randn(size)*scale).astype(np.float32)
+        return genomes
+    hits=[]
+    pos=-1
+    expected=size*rate
+    while pos<size:
+        #floor(exponential/-log(1-rate))+1 is geometric(rate), and cheaper to draw
+        gaps=np.random.standard_exponential(int(expected+6*np.sqrt(expected)+16))
+        gaps=(gaps*(-1/np.log1p(-rate))).astype(np.int64)+1
+        more=pos+np.cumsum(gaps)
+        hits.append(more)
+        pos=more[-1]
+    hits=np.concatenate(hits)
+    hits=hits[hits<size]
+    flat[hits]+=(np.random.randn(len(hits))*scale).astype(np.float32)
+    return genomes
+
+
+class rankedview:
+    """agents of a population in a given order, e.g. selection's parents"""
+
+    def __init__(self,population,order):
+        self.population=population
+        self.order=order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self,i):
+        if isinstance(i,slice):
+            return [self.population[j] for j in self.order[i]]
+        return self.population[self.order[i]]
+
+    def genomes(self,n=None):
+        """genome rows of the first n agents (a copy)"""
+        return self.population.genomes[self.order[:n]]
@@ -0,0 +1,71 @@
+import numpy as np
+from neural_network import layer_shapes
+
+
+class populationnetwork:
+    """forward pass for a whole population at once
+
+    built from a (P,n_params) genome matrix: every agent's w1/b1/w2/b2/w3/b3
+    becomes a slice of (P,in,out) tensors, so one batched matmul chain picks
+    the actions of all P agents
+    """
+
+    def __init__(self,genomes,input_size=14,hidden_size1=16,hidden_size2=16,output_size=4):
+        self.size=len(genomes)
+        self.input_size=input_size
+        self.hidden_size1=hidden_size1
+        self.hidden_size2=hidden_size2
+        self.output_size=output_size
+        pos=0
+        for name,shape in layer_shapes(input_size,hidden_size1,hidden_size2,output_size):
+            size=int(np.prod(shape))
+            block=np.asarray(genomes[:,pos:pos+size],dtype=np.float64)
+            setattr(self,name,block.reshape((self.size,)+shape))
+            pos+=size
+        self._scratch={}
+
+    @staticmethod
+    def from_genomes(genomes,input_size=14,hidden_size1=16,hidden_size2=16,output_size=4):
+        """network over a (P,n_params) matrix of flat genomes"""
+        return populationnetwork(genomes,input_size,hidden_size1,hidden_size2,output_size)
+
+    def subset(self,idx):
+        """network over the agents in idx only, e.g. the ones still alive"""
+        net=object.__new__(populationnetwork)
+        net.size=len(idx)
+        net.input_size=self.input_size
+        net.hidden_size1=self.hidden_size1
+        net.hidden_size2=self.hidden_size2
+        net.output_size=self.output_size
+        for name,_ in layer_shapes():
+            setattr(net,name,getattr(self,name)[idx])
+        net._scratch={}
+        return net
+
+    def scratch(self,k):
+        """activation buffers for k inputs per agent, reused across steps"""
+        if k not in self._scratch:
+            p=self.size
+            self._scratch[k]=(np.empty((p,k,self.hidden_size1)),
+                              np.empty((p,k,self.hidden_size2)),
+                              np.empty((p,k,self.output_size)))
+        return self._scratch[k]
+
+    def forward(self,states):
+        """states is (P,in) or (P,K,in); returns logits (P,out) or (P,K,out)"""
+        states=np.asarray(states)
+        x=states.reshape(self.size,-1,self.input_size)
+        h1,h2,out=self.scratch(x.shape[1])
+        np.matmul(x,self.w1,out=h1)
+        h1+=self.b1
+        np.maximum(h1,0,out=h1)
+        np.matmul(h1,self.w2,out=h2)
+        h2+=self.b2
+        np.maximum(h2,0,out=h2)
+        np.matmul(h2,self.w3,out=out)
+        out+=self.b3
+        return out.reshape(states.shape[:-1]+(self.output_size,))
+
+    def get_actions(self,states):
+        #softmax is monotonic, argmax of the logits gives the same action
+        return np.argmax(self.forward(states),axis=-1)
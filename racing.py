@@ -0,0 +1,89 @@
+"""racing (successive halving) fitness evaluation
+
+most agents of a generation, random children especially, are clearly
+losing within the first hundred steps. a racingscheduler plays everyone on
+a short step budget, keeps the best fraction, and only gives the survivors
+longer budgets and more episodes; the last rung is the full evaluation
+(the ga's max_steps and episodes).
+
+games are seeded, so a game replayed with a longer budget follows the same
+path and can only gain score and steps: with the same episodes, a survivor's
+fitness never drops below what it had when it beat the agents that were
+dropped. when a later rung adds episodes that no longer holds, so an agent
+dropped at a rung is capped at the lowest fitness of the agents that went
+on; selection's ranking by agent.fitness stays survivors first.
+"""
+import numpy as np
+from evaluation import fitness,summarize
+
+#(max_steps,episodes,keep) per rung before the full evaluation; max_steps
+#and episodes are capped at the ga's, keep is the fraction that goes on
+DEFAULT_SCHEDULE=((100,1,0.5),(300,1,0.5))
+
+
+def parse_schedule(text):
+    """"100:1:0.5,300:1:0.5" -> ((100,1,0.5),(300,1,0.5))"""
+    schedule=[]
+    for rung in text.split(","):
+        max_steps,episodes,keep=rung.split(":")
+        schedule.append((int(max_steps),int(episodes),float(keep)))
+    return tuple(schedule)
+
+
+class racingscheduler:
+    def __init__(self,schedule=DEFAULT_SCHEDULE):
+        for max_steps,episodes,keep in schedule:
+            if max_steps<1 or episodes<1 or not 0<keep<=1:
+                raise ValueError(f"bad racing rung {(max_steps,episodes,keep)}: need max_steps>=1, episodes>=1, 0<keep<=1")
+        self.schedule=tuple(schedule)
+
+    def rungs(self,max_steps,episodes):
+        """(max_steps,episodes,keep) of every rung, ending with the full evaluation"""
+        rungs=[(min(s,max_steps),min(k,episodes),keep) for s,k,keep in self.schedule]
+        return rungs+[(max_steps,episodes,1.0)]
+
+    def run(self,play,seeds,max_steps,summary="mean"):
+        """race every row of seeds; returns (fitnesses,(scores,steps,causes),played,report)
+
+        play(idx,seeds,max_steps) evaluates agents idx on the first columns
+        of seeds and returns their (scores,steps,causes). the per-episode
+        arrays are (P,K) like seeds and hold each agent's last rung; played
+        marks the episodes it got to play. report has the agents, episodes,
+        step budget and simulated steps of every rung, and budget_saved, the
+        fraction of the full evaluation's step budget that was never granted
+        """
+        n,k_full=seeds.shape
+        values=np.zeros(n)
+        scores=np.zeros((n,k_full),dtype=np.int64)
+        steps=np.zeros((n,k_full),dtype=np.int64)
+        causes=np.zeros((n,k_full),dtype=np.int8)
+        played=np.zeros((n,k_full),dtype=bool)
+        report={"rungs":[],"simulated_steps":0}
+        rungs=self.rungs(max_steps,k_full)
+        entrants=[]
+        alive=np.arange(n)
+        granted=0
+        for r,(budget,k,keep) in enumerate(rungs):
+            entrants.append(alive)
+            s,t,c=play(alive,seeds[:,:k],budget)
+            scores[alive,:k]=s
+            steps[alive,:k]=t
+            causes[alive,:k]=c
+            played[alive,:k]=True
+            v=fitness(s,t)
+            values[alive]=summarize(v,summary) if k>1 else v[:,0]
+            granted+=len(alive)*k*budget
+            report["simulated_steps"]+=int(t.sum())
+            report["rungs"].append({"agents":len(alive),"episodes":k,"max_steps":budget,"simulated_steps":int(t.sum())})
+            if r==len(rungs)-1:
+                break
+            n_keep=max(1,int(np.ceil(len(alive)*keep)))
+            order=np.argsort(-values[alive],kind="stable")
+            alive=np.sort(alive[order[:n_keep]])
+        #agents dropped at a rung rank below every agent that went further
+        for r in range(len(entrants)-2,-1,-1):
+            went_on=entrants[r+1]
+            dropped=np.setdiff1d(entrants[r],went_on)
+            values[dropped]=np.minimum(values[dropped],values[went_on].min())
+        report["budget_saved"]=1-granted/(n*k_full*max_steps) if n else 0.0
+        return values,(scores,steps,causes),played,report
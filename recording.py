@@ -0,0 +1,155 @@
+"""compact, deterministic episode recordings
+
+a seeded game is fully determined by its apple seed and the actions taken,
+so an episode is stored as the seed plus the action stream packed at
+2 bits per step (4 steps per byte). episodereplayer rebuilds any frame of
+a snakegame from that without the network, seeking through keyframes.
+
+file layout (little endian): header magic "SNKR", version u2, episode
+count u4; then per episode seed u8, width u2, height u2, steps u4,
+score u4, fitness f8, death cause u1, followed by ceil(steps/4) bytes of
+packed actions
+"""
+import copy
+import struct
+import numpy as np
+from snake_game import snakegame
+from batch_snake_game import BatchSnakeEnv,CAUSES,STEP_CAP
+from population_network import populationnetwork
+from checkpoint import _atomic_write
+
+MAGIC=b"SNKR"
+VERSION=1
+DEFAULT_RECORDINGS="episodes.rec"
+
+_HEADER=struct.Struct("<4sHI")
+_EPISODE=struct.Struct("<QHHIIdB")
+
+
+def pack_actions(actions):
+    """action codes (0-3) -> uint8 array, 4 actions per byte, first in the low bits"""
+    actions=np.asarray(actions,dtype=np.uint8)
+    padded=np.zeros(-(-len(actions)//4)*4,dtype=np.uint8)
+    padded[:len(actions)]=actions
+    a=padded.reshape(-1,4)
+    return a[:,0]|(a[:,1]<<2)|(a[:,2]<<4)|(a[:,3]<<6)
+
+
+def unpack_actions(packed,steps):
+    packed=np.asarray(packed,dtype=np.uint8)
+    actions=np.stack([packed&3,(packed>>2)&3,(packed>>4)&3,packed>>6],axis=1).reshape(-1)
+    return actions[:steps]
+
+
+class episoderecording:
+    def __init__(self,seed,width,height,actions,steps,score=0,fitness=0.0,cause=0):
+        self.seed=int(seed)
+        self.width=width
+        self.height=height
+        self.packed=np.asarray(actions,dtype=np.uint8)  #pack_actions output
+        self.steps=steps
+        self.score=score
+        self.fitness=fitness
+        self.cause=cause
+
+    def actions(self):
+        return unpack_actions(self.packed,self.steps)
+
+    def __repr__(self):
+        return (f"episoderecording(seed={self.seed}, steps={self.steps}, score={self.score}, "
+                f"death={CAUSES[self.cause]}, {self.packed.nbytes} bytes of actions)")
+
+
+def record_episodes(genomes,seeds,sizes=(14,16,16,4),max_steps=1000,fitness=None,**env_options):
+    """play genomes (P,n_params) on seeds (P,) or (P,K) and record every episode
+
+    same rules and early stopping as evaluation.play, so the recordings are
+    the episodes the agents were scored on
+    """
+    seeds=np.asarray(seeds,dtype=np.uint64)
+    p=len(genomes)
+    k=seeds.size//p
+    net=populationnetwork.from_genomes(genomes,*sizes)
+    env=BatchSnakeEnv(p*k,seeds=seeds.reshape(-1),**env_options)
+    history=np.zeros((max_steps,p*k),dtype=np.uint8)
+    steps=np.zeros(p*k,dtype=np.int64)
+    for t in range(max_steps):
+        alive=env.alive
+        if not alive.any():
+            break
+        actions=net.get_actions(env.state.reshape(p,k,-1)).reshape(-1)
+        history[t]=actions
+        steps[alive]+=1
+        env.step(actions)
+    causes=np.where(env.alive,STEP_CAP,env.causes)
+    recordings=[]
+    for i in range(p*k):
+        value=0.0 if fitness is None else float(fitness[i//k])
+        recordings.append(episoderecording(seeds.reshape(-1)[i],env.width,env.height,pack_actions(history[:steps[i],i]),
+                                           int(steps[i]),int(env.scores[i]),value,int(causes[i])))
+    return recordings
+
+
+def save_recordings(recordings,filename=DEFAULT_RECORDINGS):
+    def write(f):
+        f.write(_HEADER.pack(MAGIC,VERSION,len(recordings)))
+        for r in recordings:
+            f.write(_EPISODE.pack(r.seed,r.width,r.height,r.steps,r.score,r.fitness,r.cause))
+            f.write(r.packed.tobytes())
+    _atomic_write(filename,write)
+
+
+def load_recordings(filename=DEFAULT_RECORDINGS):
+    with open(filename,"rb") as f:
+        magic,version,count=_HEADER.unpack(f.read(_HEADER.size))
+        if magic!=MAGIC:
+            raise ValueError(f"{filename} is not an episode recording")
+        if version>VERSION:
+            raise ValueError(f"{filename} has recording version {version}, newest supported is {VERSION}")
+        recordings=[]
+        for _ in range(count):
+            seed,width,height,steps,score,fitness,cause=_EPISODE.unpack(f.read(_EPISODE.size))
+            packed=np.frombuffer(f.read(-(-steps//4)),dtype=np.uint8)
+            recordings.append(episoderecording(seed,width,height,packed,steps,score,fitness,cause))
+    return recordings
+
+
+class episodereplayer:
+    """rebuilds the snakegame of a recording at any step
+
+    a copy of the game is kept every keyframe_every steps, so seek(n)
+    replays at most keyframe_every-1 moves. game_options go to snakegame,
+    e.g. early_stop=True to see the loop/stagnation deaths
+    """
+
+    def __init__(self,recording,keyframe_every=256,**game_options):
+        self.recording=recording
+        self.keyframe_every=keyframe_every
+        self.actions=recording.actions()
+        game=snakegame(recording.width,recording.height,seed=recording.seed,**game_options)
+        self.keyframes=[copy.deepcopy(game)]
+        for t,action in enumerate(self.actions,1):
+            game.step(int(action))
+            if t%keyframe_every==0:
+                self.keyframes.append(copy.deepcopy(game))
+
+    def __len__(self):
+        """number of frames (steps+1, the start included)"""
+        return len(self.actions)+1
+
+    def seek(self,step):
+        """a fresh snakegame as it was after `step` moves"""
+        step=max(0,min(step,len(self.actions)))
+        k=step//self.keyframe_every
+        game=copy.deepcopy(self.keyframes[k])
+        for action in self.actions[k*self.keyframe_every:step]:
+            game.step(int(action))
+        return game
+
+    def frames(self,start=0):
+        """yield the game after every step from start on (the same object, updated in place)"""
+        game=self.seek(start)
+        yield game
+        for action in self.actions[start:]:
+            game.step(int(action))
+            yield game
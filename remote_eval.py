@@ -0,0 +1,296 @@
+"""fitness evaluation on remote workers over tcp
+
+the coordinator (remoteevaluator, plugged into geneticalgorithm as its
+evaluator) splits the population into chunks and hands them to any number
+of workers started with
+
+    python remote_eval.py --host COORDINATOR --port 5555
+
+on this or other machines. every message is a fixed header (kind, job id,
+payload length) followed by raw little endian data:
+
+    HELLO      worker -> coordinator   empty
+    HEARTBEAT  worker -> coordinator   empty, every `heartbeat` seconds
+    BATCH      coordinator -> worker   u4 meta length, json meta,
+                                       genomes (float32 from the ga, the
+                                       dtype is in the meta), uint64 seeds
+    RESULT     worker -> coordinator   int64 scores, int64 steps, int8 causes
+    STOP       coordinator -> worker   empty, the worker exits
+
+a worker that is silent for `timeout` seconds or whose connection drops is
+forgotten and its chunks go back to the queue. every worker has at most
+max_inflight chunks at a time, so fast workers take more of the population
+and nothing piles up behind a slow one
+"""
+import json
+import time
+import socket
+import struct
+import argparse
+import selectors
+import threading
+from collections import deque
+import numpy as np
+from evaluation import play
+from population_network import populationnetwork
+
+HELLO=1
+HEARTBEAT=2
+BATCH=3
+RESULT=4
+STOP=5
+
+_HEADER=struct.Struct("<BIQ")
+_META=struct.Struct("<I")
+
+
+def _message(kind,job=0,payload=b""):
+    return _HEADER.pack(kind,job,len(payload))+payload
+
+
+def _recv_exact(sock,n):
+    data=bytearray()
+    while len(data)<n:
+        chunk=sock.recv(n-len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data+=chunk
+    return bytes(data)
+
+
+def pack_batch(genomes,seeds,sizes,max_steps,env_options):
+    #genomes go as they are (float32 from the ga), little endian
+    genomes=np.ascontiguousarray(genomes,dtype=np.asarray(genomes).dtype.newbyteorder("<"))
+    seeds=np.ascontiguousarray(seeds,dtype="<u8")
+    meta=json.dumps({"shape":genomes.shape,"dtype":genomes.dtype.str,"seeds_shape":seeds.shape,"sizes":list(sizes),
+                     "max_steps":max_steps,"env_options":env_options}).encode()
+    return _META.pack(len(meta))+meta+genomes.tobytes()+seeds.tobytes()
+
+
+def unpack_batch(payload):
+    """(genomes,seeds,sizes,max_steps,env_options) from a BATCH payload"""
+    (n,)=_META.unpack_from(payload)
+    meta=json.loads(payload[_META.size:_META.size+n])
+    pos=_META.size+n
+    genomes=np.frombuffer(payload,dtype=meta.get("dtype","<f8"),count=int(np.prod(meta["shape"])),offset=pos).reshape(meta["shape"])
+    pos+=genomes.nbytes
+    seeds=np.frombuffer(payload,dtype="<u8",count=int(np.prod(meta["seeds_shape"])),offset=pos).reshape(meta["seeds_shape"])
+    return genomes,seeds,meta["sizes"],meta["max_steps"],meta["env_options"]
+
+
+def pack_result(scores,steps,causes):
+    return (np.ascontiguousarray(scores,dtype="<i8").tobytes()+np.ascontiguousarray(steps,dtype="<i8").tobytes()
+            +np.ascontiguousarray(causes,dtype="i1").tobytes())
+
+
+def unpack_result(payload,shape):
+    n=int(np.prod(shape))
+    scores=np.frombuffer(payload,dtype="<i8",count=n).reshape(shape)
+    steps=np.frombuffer(payload,dtype="<i8",count=n,offset=8*n).reshape(shape)
+    causes=np.frombuffer(payload,dtype="i1",count=n,offset=16*n).reshape(shape)
+    return scores,steps,causes
+
+
+class _connection:
+    def __init__(self,sock,address):
+        self.sock=sock
+        self.address=address
+        self.buffer=bytearray()
+        self.jobs=set()
+        self.last_seen=time.monotonic()
+
+    def messages(self):
+        """complete (kind,job,payload) messages received so far"""
+        while len(self.buffer)>=_HEADER.size:
+            kind,job,length=_HEADER.unpack_from(self.buffer)
+            end=_HEADER.size+length
+            if len(self.buffer)<end:
+                return
+            payload=bytes(self.buffer[_HEADER.size:end])
+            del self.buffer[:end]
+            yield kind,job,payload
+
+
+class remoteevaluator:
+    """coordinator side; a drop-in for parallelevaluator
+
+    evaluate() blocks until every chunk has come back, waiting for workers
+    to connect if there are none yet
+    """
+
+    def __init__(self,host="0.0.0.0",port=5555,chunk_size=None,timeout=10.0,max_inflight=2):
+        self.chunk_size=chunk_size
+        self.timeout=timeout
+        self.max_inflight=max_inflight
+        self.listener=socket.create_server((host,port))
+        self.listener.setblocking(False)
+        self.port=self.listener.getsockname()[1]
+        self.selector=selectors.DefaultSelector()
+        self.selector.register(self.listener,selectors.EVENT_READ)
+        self.connections=[]
+        self.next_job=0
+        self.jobs={}
+        self.pending=deque()
+
+    def evaluate(self,genomes,seeds,sizes=(14,16,16,4),max_steps=1000,env_options=None):
+        """(scores,steps,causes) for every row of a (P,n_params) genome matrix"""
+        seeds=np.asarray(seeds,dtype=np.uint64)
+        n=len(genomes)
+        chunk=self.chunk_size or max(1,-(-n//(max(len(self.connections),1)*4)))
+        scores=np.zeros(seeds.shape,dtype=np.int64)
+        steps=np.zeros(seeds.shape,dtype=np.int64)
+        causes=np.zeros(seeds.shape,dtype=np.int8)
+        #job id -> (start,end) of every chunk not back yet
+        self.jobs={}
+        self.pending=deque()
+        for start in range(0,n,chunk):
+            self.jobs[self.next_job]=(start,min(start+chunk,n))
+            self.pending.append(self.next_job)
+            self.next_job+=1
+        options=env_options or {}
+        #workers weren't read from between generations, don't count that as silence
+        now=time.monotonic()
+        for conn in self.connections:
+            conn.last_seen=now
+        while self.jobs:
+            self.dispatch(genomes,seeds,sizes,max_steps,options)
+            for key,_ in self.selector.select(timeout=min(1.0,self.timeout/2)):
+                if key.fileobj is self.listener:
+                    self.accept()
+                    continue
+                conn=key.data
+                for kind,job,payload in self.receive(conn):
+                    if kind==RESULT:
+                        conn.jobs.discard(job)
+                        if job in self.jobs:
+                            start,end=self.jobs.pop(job)
+                            result=unpack_result(payload,seeds[start:end].shape)
+                            scores[start:end],steps[start:end],causes[start:end]=result
+            self.check_timeouts()
+        return scores,steps,causes
+
+    def dispatch(self,genomes,seeds,sizes,max_steps,options):
+        """send queued chunks to workers with room for more"""
+        for conn in list(self.connections):
+            while self.pending and len(conn.jobs)<self.max_inflight:
+                job=self.pending.popleft()
+                start,end=self.jobs[job]
+                payload=pack_batch(genomes[start:end],seeds[start:end],sizes,max_steps,options)
+                conn.jobs.add(job)
+                try:
+                    conn.sock.sendall(_message(BATCH,job,payload))
+                except OSError:
+                    self.drop(conn,"send failed")
+                    break
+
+    def accept(self):
+        try:
+            sock,address=self.listener.accept()
+        except BlockingIOError:
+            return
+        #a timeout (not non-blocking) so sendall of a big batch can wait for the worker
+        sock.settimeout(self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+        conn=_connection(sock,address)
+        self.connections.append(conn)
+        self.selector.register(sock,selectors.EVENT_READ,conn)
+        print(f"worker connected from {address[0]}:{address[1]} ({len(self.connections)} total)")
+
+    def receive(self,conn):
+        try:
+            data=conn.sock.recv(1<<20)
+        except OSError:
+            data=b""
+        if not data:
+            self.drop(conn,"disconnected")
+            return []
+        conn.buffer+=data
+        conn.last_seen=time.monotonic()
+        return list(conn.messages())
+
+    def check_timeouts(self):
+        now=time.monotonic()
+        for conn in list(self.connections):
+            if now-conn.last_seen>self.timeout:
+                self.drop(conn,f"no heartbeat for {self.timeout:.0f}s")
+
+    def drop(self,conn,reason):
+        """forget a worker and requeue its chunks"""
+        if conn not in self.connections:
+            return
+        self.connections.remove(conn)
+        self.selector.unregister(conn.sock)
+        conn.sock.close()
+        requeue=[job for job in conn.jobs if job in self.jobs]
+        self.pending.extendleft(requeue)
+        print(f"worker {conn.address[0]}:{conn.address[1]} {reason}, requeued {len(requeue)} chunks")
+
+    def close(self):
+        """tell the workers to exit and stop listening"""
+        for conn in self.connections:
+            try:
+                conn.sock.sendall(_message(STOP))
+            except OSError:
+                pass
+            conn.sock.close()
+        self.connections=[]
+        self.selector.close()
+        self.listener.close()
+
+
+def _serve(sock,heartbeat):
+    """evaluate batches from one coordinator connection; True if told to stop"""
+    lock=threading.Lock()
+    done=threading.Event()
+    def beat():
+        while not done.wait(heartbeat):
+            try:
+                with lock:
+                    sock.sendall(_message(HEARTBEAT))
+            except OSError:
+                return
+    with lock:
+        sock.sendall(_message(HELLO))
+    threading.Thread(target=beat,daemon=True).start()
+    try:
+        while True:
+            kind,job,length=_HEADER.unpack(_recv_exact(sock,_HEADER.size))
+            payload=_recv_exact(sock,length)
+            if kind==STOP:
+                return True
+            if kind!=BATCH:
+                continue
+            genomes,seeds,sizes,max_steps,env_options=unpack_batch(payload)
+            net=populationnetwork.from_genomes(genomes,*sizes)
+            result=pack_result(*play(net,seeds,max_steps,**env_options))
+            with lock:
+                sock.sendall(_message(RESULT,job,result))
+    finally:
+        done.set()
+
+
+def run_worker(host="localhost",port=5555,heartbeat=2.0,retry=1.0):
+    """serve a coordinator until it sends STOP, reconnecting if the link drops"""
+    while True:
+        try:
+            sock=socket.create_connection((host,port))
+        except OSError:
+            time.sleep(retry)
+            continue
+        sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+        try:
+            if _serve(sock,heartbeat):
+                return
+        except OSError as e:
+            print(f"lost coordinator {host}:{port}: {e}")
+        finally:
+            sock.close()
+
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="snake ai remote evaluation worker")
+    parser.add_argument("--host",default="localhost",help="coordinator address")
+    parser.add_argument("--port",type=int,default=5555)
+    parser.add_argument("--heartbeat",type=float,default=2.0,help="seconds between heartbeats")
+    args=parser.parse_args()
+    run_worker(args.host,args.port,args.heartbeat)
@@ -0,0 +1,60 @@
+"""drawing for snakegame
+
+pygame is imported on the first draw, so the game rules, training and the
+evaluation workers never load it
+"""
+
+
+class gamerenderer:
+    """draws snakegames, caching everything that doesn't change per frame
+
+    the grid is pre-rendered once per board size onto a background surface
+    and the score font is created once, so a frame is one blit plus the
+    snake and apple rects
+    """
+
+    def __init__(self,background=(0,0,0)):
+        self.background=background
+        self.grids={}
+        self.font=None
+
+    def grid(self,game):
+        key=(game.width,game.height,game.block_size)
+        if key not in self.grids:
+            import pygame
+            size=game.block_size
+            surface=pygame.Surface((game.width*size+1,game.height*size+1))
+            surface.fill(self.background)
+            for x in range(game.width+1):
+                pygame.draw.line(surface,(40,40,40),(x*size,0),(x*size,game.height*size))
+            for y in range(game.height+1):
+                pygame.draw.line(surface,(40,40,40),(0,y*size),(game.width*size,y*size))
+            self.grids[key]=surface.convert() if pygame.display.get_surface() else surface
+        return self.grids[key]
+
+    def render(self,game,screen,offset_x=0,offset_y=0):
+        """draw game onto screen; returns the rect it covered (for display.update)"""
+        import pygame
+        size=game.block_size
+        #grid background, also wipes the previous frame
+        rect=screen.blit(self.grid(game),(offset_x,offset_y))
+        #draw snake
+        for i,segment in enumerate(game.snake):
+            color=(0,255,0) if i==0 else (0,200,0)
+            screen.fill(color,(offset_x+segment[0]*size,offset_y+segment[1]*size,size-2,size-2))
+        #draw apple
+        screen.fill((255,0,0),(offset_x+game.apple[0]*size,offset_y+game.apple[1]*size,size-2,size-2))
+        #draw score
+        if self.font is None:
+            self.font=pygame.font.Font(None,36)
+        text=self.font.render(f"score:{game.score}",True,(255,255,255))
+        screen.blit(text,(offset_x+10,offset_y+10))
+        return rect
+
+
+_default=gamerenderer()
+
+
+def render(game,screen,offset_x=0,offset_y=0):
+    """draw game with a shared gamerenderer; returns the rect it covered"""
+    return _default.render(game,screen,offset_x,offset_y)
@@ -1,41 +1,95 @@
-import pygame
 import random
-import time
-import math
+from collections import deque
+from batch_snake_game import apple_priority
+from state_encoder import encoder_for,statebuffer
 
 class snakegame:
 
-    def __init__(self,width=30,height=30):
+    def __init__(self,width=30,height=30,loop_window=64,loop_threshold=8,apple_timeout=200,early_stop=False,seed=None,
+                 vision=False):
         self.width=width
         self.height=height
         self.block_size=15
-        self.reset()
+        #loop/stagnation detection, all measured in game steps
+        self.loop_window=loop_window  #steps of position history kept
+        self.loop_threshold=loop_threshold  #visits to one cell within the window
+        self.apple_timeout=apple_timeout  #steps allowed between apples
+        self.early_stop=early_stop  #end the episode when stuck
+        #network inputs, re-encoded from lookup tables only where they changed;
+        #vision adds 8 wall/body/apple rays read off the occupancy bitboard
+        self.vision=vision
+        self.state=statebuffer(encoder_for(width,height),vision)
+        self.reset(seed)
 
     
-    def reset(self):
+    def reset(self,seed=None):
+        #with a seed, apples follow the same sequence as a BatchSnakeEnv game
+        #with that seed; without one they come from the random module
+        self.seed=seed
+        self.apple_count=0
         #init snake at center
-        self.snake=[(self.width//2,self.height//2)]
-        self.direction=(0,-1)#up
+        self.set_body([(self.width//2,self.height//2)],(0,-1))#up
         self.score=0
         self.steps=0
         self.max_steps=2000
-        #track position visits to detect looping
-        self.position_history={}  #pos->list of timestamps
-        self.loop_threshold=5  #visits in 3 sec
-        self.loop_window=3.0  #seconds
+        #ring buffer of the last loop_window positions and their visit counts
+        self.recent=deque()
+        self.visits={}
         #track apple eating for stagnation detection
-        self.last_apple_time=time.time()
-        self.apple_timeout=10.0  #seconds to get next apple
+        self.steps_since_apple=0
+        self.death_cause=None
         self.place_apple()
 
         return self.get_state()
 
     
+    def set_body(self,body,direction):
+        """replace the snake (head first) and rebuild the occupancy structures"""
+        self.snake=deque(body)
+        self.direction=direction
+        #occupied cells, kept in sync with self.snake for O(1) collision checks
+        self.occupied=set(self.snake)
+        #the same cells as a bitboard, bit y*width+x (kept up only with vision)
+        self.grid=sum(1<<(y*self.width+x) for x,y in self.occupied) if self.vision else 0
+        #free cells as a list plus each cell's index in it for O(1) removal
+        self.free=[]
+        self.free_index={}
+        for y in range(self.height):
+            for x in range(self.width):
+                if (x,y) not in self.occupied:
+                    self.free_index[(x,y)]=len(self.free)
+                    self.free.append((x,y))
+
+    def occupy(self,pos):
+        self.occupied.add(pos)
+        if self.vision:
+            self.grid|=1<<(pos[1]*self.width+pos[0])
+        #swap the last free cell into pos's slot
+        i=self.free_index.pop(pos)
+        last=self.free.pop()
+        if last!=pos:
+            self.free[i]=last
+            self.free_index[last]=i
+
+    def vacate(self,pos):
+        self.occupied.discard(pos)
+        if self.vision:
+            self.grid&=~(1<<(pos[1]*self.width+pos[0]))
+        self.free_index[pos]=len(self.free)
+        self.free.append(pos)
+
     def place_apple(self):
-        while True:
-            self.apple=(random.randint(0,self.width-1),random.randint(0,self.height-1))
-            if self.apple not in self.snake:
-                break
+        #the board is full - nowhere left to put an apple
+        if not self.free:
+            return
+        if self.seed is None:
+            self.apple=self.free[random.randrange(len(self.free))]
+        else:
+            prio=apple_priority(self.seed,self.apple_count,self.width*self.height)[0]
+            prio[[y*self.width+x for x,y in self.occupied]]=0
+            cell=int(prio.argmax())
+            self.apple=(cell%self.width,cell//self.width)
+        self.apple_count+=1
     
     def get_direction_code(self):
         """return direction as 0=up,1=down,2=left,3=right"""
@@ -50,55 +104,32 @@ class snakegame:
         return 0
     
     def get_state(self):
-        #input: head_x, head_y, tail_x, tail_y, apple_x, apple_y, direction,
-        #        dist_left, dist_right, dist_top, dist_bottom, apple_dx, apple_dy, apple_distance
+        """network inputs as a float32 array (see state_encoder)
+
+        the array is a buffer owned by the game: the next step or reset
+        overwrites it, copy it to keep it
+        """
         head=self.snake[0]
-        tail=self.snake[-1] if len(self.snake)>1 else head
-        direction_code=self.get_direction_code()
-        
-        #distance to walls (negative when close - danger signal)
-        dist_left=-head[0]  #0 at left wall, more negative further right
-        dist_right=-(self.width-1-head[0])  #0 at right wall
-        dist_top=-head[1]  #0 at top wall
-        dist_bottom=-(self.height-1-head[1])  #0 at bottom wall
-        
-        #signed distance to apple (positive = apple is in that direction)
-        apple_dx=self.apple[0]-head[0]  #positive if apple to the right
-        apple_dy=self.apple[1]-head[1]  #positive if apple below
-        
-        #Euclidean distance to apple (normalized)
-        apple_distance=math.sqrt(apple_dx**2+apple_dy**2)
-        max_dist=math.sqrt(self.width**2+self.height**2)
-        
-        return (
-            head[0]/self.width,
-            head[1]/self.height,
-            tail[0]/self.width,
-            tail[1]/self.height,
-            self.apple[0]/self.width,
-            self.apple[1]/self.height,
-            direction_code/3.0,  #normalize to 0-1
-            dist_left/self.width,  #negative near left wall
-            dist_right/self.width,  #negative near right wall
-            dist_top/self.height,  #negative near top wall
-            dist_bottom/self.height,  #negative near bottom wall
-            apple_dx/self.width,  #positive if apple right
-            apple_dy/self.height,  #positive if apple below
-            apple_distance/max_dist  #normalized Euclidean distance (0-1, smaller is closer)
-        )
+        tail=self.snake[-1]
+        return self.state.update(head,tail,self.apple,self.direction,self.grid)
 
     
     def check_looping(self,pos):
         """check if snake is stuck visiting same positions"""
-        current_time=time.time()
-        if pos not in self.position_history:
-            self.position_history[pos]=[]
-        #add current visit
-        self.position_history[pos].append(current_time)
-        #remove old visits outside window
-        self.position_history[pos]=[t for t in self.position_history[pos] if current_time-t<=self.loop_window]
+        self.recent.append(pos)
+        self.visits[pos]=self.visits.get(pos,0)+1
+        #forget the visit that fell out of the window
+        if len(self.recent)>self.loop_window:
+            old=self.recent.popleft()
+            self.visits[old]-=1
+            if not self.visits[old]:
+                del self.visits[old]
         #check if visited too many times
-        return len(self.position_history[pos])>self.loop_threshold
+        return self.visits[pos]>self.loop_threshold
+
+    def is_stagnating(self):
+        """no apple for apple_timeout steps"""
+        return self.steps_since_apple>=self.apple_timeout
 
     def step(self,action):
         #action:0=up,1=down,2=left,3=right
@@ -118,28 +149,41 @@ class snakegame:
         
         #die on wall collision
         if new_head[0]<0 or new_head[0]>=self.width or new_head[1]<0 or new_head[1]>=self.height:
+            self.death_cause="wall"
             return self.get_state(),False,self.score
         
         #die on self collision (fatal)
-        if new_head in self.snake:
+        if new_head in self.occupied:
+            self.death_cause="self"
             return self.get_state(),False,self.score
         
         #check if snake is stuck looping
-        self.check_looping(new_head)
+        looping=self.check_looping(new_head)
         
-        self.snake.insert(0,new_head)
+        self.snake.appendleft(new_head)
+        self.occupy(new_head)
         
         #eat apple - elongate by 1 (don't pop tail)
         if new_head==self.apple:
             self.score+=1
-            self.last_apple_time=time.time()  #reset timer
+            self.steps_since_apple=0  #reset timer
             self.place_apple()
             #snake grows by 1, no pop()
         else:
-            self.snake.pop()
+            self.vacate(self.snake.pop())
+            self.steps_since_apple+=1
         
         self.steps+=1
         
+        #end the episode early when the snake is going nowhere
+        if self.early_stop:
+            if looping:
+                self.death_cause="loop"
+                return self.get_state(),False,self.score
+            if self.is_stagnating():
+                self.death_cause="stagnation"
+                return self.get_state(),False,self.score
+        
         return self.get_state(),True,self.score
 
     
@@ -148,27 +192,11 @@ class snakegame:
         if head[0]<0 or head[0]>=self.width or head[1]<0 or head[1]>=self.height:
             return True
         #also check self collision
-        if head in self.snake[1:]:
+        if len(self.occupied)<len(self.snake):
             return True
         return False
     
     def render(self,screen,offset_x=0,offset_y=0):
-        #draw grid background
-        for x in range(self.width+1):
-            pygame.draw.line(screen,(40,40,40),
-                           (offset_x+x*self.block_size,offset_y),
-                           (offset_x+x*self.block_size,offset_y+self.height*self.block_size))
-        for y in range(self.height+1):
-            pygame.draw.line(screen,(40,40,40),
-                           (offset_x,offset_y+y*self.block_size),
-                           (offset_x+self.width*self.block_size,offset_y+y*self.block_size))
-        #draw snake
-        for i,segment in enumerate(self.snake):
-            color=(0,255,0) if i==0 else (0,200,0)
-            pygame.draw.rect(screen,color,(offset_x+segment[0]*self.block_size,offset_y+segment[1]*self.block_size,self.block_size-2,self.block_size-2))
-        #draw apple
-        pygame.draw.rect(screen,(255,0,0),(offset_x+self.apple[0]*self.block_size,offset_y+self.apple[1]*self.block_size,self.block_size-2,self.block_size-2))
-        #draw score
-        font=pygame.font.Font(None,36)
-        text=font.render(f"score:{self.score}",True,(255,255,255))
-        screen.blit(text,(offset_x+10,offset_y+10))
+        #drawing lives in renderer so the rules don't need pygame
+        from renderer import render
+        return render(self,screen,offset_x,offset_y)
@@ -0,0 +1,229 @@
+"""network inputs from lookup tables, shared by snakegame and BatchSnakeEnv
+
+the 14 inputs are
+    0-1   head x/w, y/h          7-10  wall distances (<=0, 0 at the wall)
+    2-3   tail x/w, y/h          11-12 apple dx/w, dy/h
+    4-5   apple x/w, y/h         13    apple distance / board diagonal
+    6     direction code/3
+every one of them is a function of a cell or of the head->apple offset, so
+each board size gets float32 tables indexed by flat cell (y*w+x) and by
+offset, built once; encoding is then table lookups, no sqrt or division.
+both engines read the same float32 tables, so a game's inputs are
+bit-identical in snakegame and BatchSnakeEnv
+
+with vision on, 24 ray inputs follow (see rayencoder)
+    14-21 wall, 22-29 body, 30-37 apple, one per ray in RAYS order
+each is 1/(cells to it along the ray), 0 when the ray sees no body or apple
+"""
+import numpy as np
+
+STATE_SIZE=14
+VISION_SIZE=24
+#ray directions: up, down, left, right, up-left, up-right, down-left, down-right
+RAYS=((0,-1),(0,1),(-1,0),(1,0),(-1,-1),(1,-1),(-1,1),(1,1))
+#direction vector -> action code, as in snakegame.get_direction_code
+DIRECTION_CODES={(0,-1):0,(0,1):1,(-1,0):2,(1,0):3}
+
+_encoders={}
+
+
+class stateencoder:
+    def __init__(self,width,height):
+        self.width=width
+        self.height=height
+        x=np.tile(np.arange(width),height)
+        y=np.repeat(np.arange(height),width)
+        #per cell, as rows: x/w, y/h and the four wall distances of a head there
+        self.cells=np.array([x/width,y/height,-x/width,-(width-1-x)/width,-y/height,-(height-1-y)/height],dtype=np.float32)
+        #per head->apple offset, as rows: dx/w, dy/h, distance/diagonal. the
+        #column of an offset is key[apple]-key[head]+center
+        dx=np.repeat(np.arange(-(width-1),width),2*height-1)
+        dy=np.tile(np.arange(-(height-1),height),2*width-1)
+        max_dist=np.sqrt(width**2+height**2)
+        self.offsets=np.array([dx/width,dy/height,np.sqrt(dx*dx+dy*dy)/max_dist],dtype=np.float32)
+        self.key=x*(2*height-1)+y
+        self.center=(width-1)*(2*height-1)+height-1
+        self.direction=(np.arange(4)/3.0).astype(np.float32)
+        #the same values as python floats for the scalar engine, which
+        #writes them one by one into a memoryview (much cheaper than numpy
+        #slicing for 14 values)
+        self.cell_values=[tuple(row) for row in self.cells.T.tolist()]
+        self.offset_values=[tuple(row) for row in self.offsets.T.tolist()]
+        self.key_values=self.key.tolist()
+        self.direction_values=self.direction.tolist()
+        self._rays=None
+
+    @property
+    def rays(self):
+        """vision ray tables of this board size, built on first use"""
+        if self._rays is None:
+            self._rays=rayencoder(self)
+        return self._rays
+
+    def encode_batch(self,out,heads,tails,apples,dirs):
+        """fill (n,14) rows from flat head/tail/apple cells and direction codes"""
+        rows=np.empty((STATE_SIZE,len(heads)),dtype=np.float32)
+        head=self.cells.take(heads,axis=1)
+        rows[0:2]=head[0:2]
+        rows[7:11]=head[2:6]
+        rows[2:4]=self.cells[0:2].take(tails,axis=1)
+        rows[4:6]=self.cells[0:2].take(apples,axis=1)
+        rows[6]=self.direction.take(dirs)
+        rows[11:14]=self.offsets.take(self.key.take(apples)-self.key.take(heads)+self.center,axis=1)
+        out[:]=rows.T
+        return out
+
+
+class rayencoder:
+    """8-direction wall/body/apple rays from an occupancy grid
+
+    wall and apple inputs only depend on the head cell and the head->apple
+    offset, so they are table rows like the base inputs. the body input
+    needs the nearest occupied cell along each ray: the scalar engine keeps
+    its occupancy as one python int with a bit per cell, masks it with the
+    ray's precomputed cells and reads the nearest hit off the lowest or
+    highest set bit, a constant number of int ops per ray however long the
+    snake is. the batch engine gathers its bool occupancy grid along the
+    ray cells of every game at once
+    """
+
+    def __init__(self,encoder):
+        width,height=encoder.width,encoder.height
+        self.encoder=encoder
+        self.n_cells=width*height
+        reach=max(width,height)
+        #1/k for k cells along a ray, 0 for "nothing on this ray"
+        self.inverse=np.concatenate([[0.0],1/np.arange(1,reach+1)]).astype(np.float32)
+        dx=np.array([d[0] for d in RAYS])
+        dy=np.array([d[1] for d in RAYS])
+        #cells along every ray from every cell, nearest first: (cells,8,reach-1)
+        k=np.arange(1,reach)
+        x=np.tile(np.arange(width),height)[:,None,None]+dx[None,:,None]*k
+        y=np.repeat(np.arange(height),width)[:,None,None]+dy[None,:,None]*k
+        self.inside=(x>=0)&(x<width)&(y>=0)&(y<height)
+        self.ray_cells=np.where(self.inside,y*width+x,0)
+        #rows of per cell wall inputs: the wall is one past the last board cell
+        self.walls=self.inverse[self.inside.sum(axis=2)+1].T.copy()
+        #rows of per head->apple offset apple inputs, keyed like stateencoder.offsets
+        ox=np.repeat(np.arange(-(width-1),width),2*height-1)
+        oy=np.tile(np.arange(-(height-1),height),2*width-1)
+        seen=((np.sign(ox)==dx[:,None])&(np.sign(oy)==dy[:,None])
+              &((dx[:,None]==0)|(dy[:,None]==0)|(np.abs(ox)==np.abs(oy))))
+        self.apples=np.where(seen,self.inverse[np.maximum(np.abs(ox),np.abs(oy))],0).astype(np.float32)
+        #scalar engine: python values, the bit mask of every ray's cells and
+        #whether the nearest hit is its lowest (cell index grows along the ray)
+        #or highest set bit
+        self.inverse_values=self.inverse.tolist()
+        self.wall_values=[tuple(row) for row in self.walls.T.tolist()]
+        self.apple_values=[tuple(row) for row in self.apples.T.tolist()]
+        self.masks=[tuple(sum(1<<c for c in cells[inside].tolist()) for cells,inside in zip(cell_rays,inside_rays))
+                    for cell_rays,inside_rays in zip(self.ray_cells,self.inside)]
+        strides=dy*width+dx
+        self.rays=tuple(zip(strides.tolist(),np.abs(strides).tolist()))
+
+    def body_values(self,grid,cell):
+        """8 body inputs of a head at cell, grid has bit c set for occupied cell c"""
+        inverse=self.inverse_values
+        values=[]
+        for mask,(stride,step) in zip(self.masks[cell],self.rays):
+            hits=grid&mask
+            if not hits:
+                values.append(0.0)
+            elif stride>0:
+                values.append(inverse[((hits&-hits).bit_length()-1-cell)//step])
+            else:
+                values.append(inverse[(cell-hits.bit_length()+1)//step])
+        return values
+
+    def encode_batch(self,out,occupancy,games,heads,apples):
+        """fill (n,24) ray rows of games (indices into the (N,cells) occupancy grid)"""
+        e=self.encoder
+        out[:,0:8]=self.walls.take(heads,axis=1).T
+        cells=self.ray_cells.take(heads,axis=0)
+        hits=occupancy.reshape(-1).take(cells+(games*self.n_cells)[:,None,None])
+        hits&=self.inside.take(heads,axis=0)
+        nearest=hits.argmax(axis=2)+1
+        out[:,8:16]=np.where(hits.any(axis=2),self.inverse.take(nearest),0)
+        out[:,16:24]=self.apples.take(e.key.take(apples)-e.key.take(heads)+e.center,axis=1).T
+        return out
+
+
+def state_size(vision=False):
+    """number of network inputs with or without vision rays"""
+    return STATE_SIZE+VISION_SIZE if vision else STATE_SIZE
+
+
+def encoder_for(width,height):
+    """the shared stateencoder of a board size"""
+    key=(width,height)
+    if key not in _encoders:
+        _encoders[key]=stateencoder(width,height)
+    return _encoders[key]
+
+
+class statebuffer:
+    """one game's inputs in a reusable float32 buffer
+
+    update() only re-encodes the features whose head, tail, apple or
+    direction changed since the last call (the body rays, with vision, on
+    every call); the network reads `values` directly, so it is overwritten
+    in place by the next update
+    """
+
+    def __init__(self,encoder,vision=False):
+        self.encoder=encoder
+        self.rays=encoder.rays if vision else None
+        self.values=np.zeros(state_size(vision),dtype=np.float32)
+        self.view=memoryview(self.values)
+        self.head=None
+        self.tail=None
+        self.apple=None
+        self.direction=None
+
+    def __deepcopy__(self,memo):
+        """copies share the encoder tables and get their own buffer
+        (a memoryview can't be copied, and the tables are megabytes with vision)"""
+        new=statebuffer.__new__(statebuffer)
+        memo[id(self)]=new
+        new.encoder=self.encoder
+        new.rays=self.rays
+        new.values=self.values.copy()
+        new.view=memoryview(new.values)
+        new.head=self.head
+        new.tail=self.tail
+        new.apple=self.apple
+        new.direction=self.direction
+        return new
+
+    def update(self,head,tail,apple,direction,grid=0):
+        """grid is the occupancy bitboard, only read with vision"""
+        e=self.encoder
+        v=self.view
+        w=e.width
+        cell=head[1]*w+head[0]
+        moved=head!=self.head
+        if moved:
+            v[0],v[1],v[7],v[8],v[9],v[10]=e.cell_values[cell]
+        if tail!=self.tail:
+            v[2],v[3]=e.cell_values[tail[1]*w+tail[0]][0:2]
+            self.tail=tail
+        if apple!=self.apple:
+            v[4],v[5]=e.cell_values[apple[1]*w+apple[0]][0:2]
+        if moved or apple!=self.apple:
+            offset=e.key_values[apple[1]*w+apple[0]]-e.key_values[cell]+e.center
+            v[11],v[12],v[13]=e.offset_values[offset]
+            if self.rays is not None:
+                for i,x in enumerate(self.rays.apple_values[offset],30):
+                    v[i]=x
+            self.head=head
+            self.apple=apple
+        if direction!=self.direction:
+            v[6]=e.direction_values[DIRECTION_CODES.get(direction,0)]
+            self.direction=direction
+        if self.rays is not None:
+            if moved:
+                for i,x in enumerate(self.rays.wall_values[cell],14):
+                    v[i]=x
+            for i,x in enumerate(self.rays.body_values(grid,cell),22):
+                v[i]=x
+        return self.values
@@ -1,4 +1,11 @@
+import os
+import copy
+import tempfile
+import numpy as np
 from snake_game import snakegame
+from batch_snake_game import BatchSnakeEnv,CAUSES
+from neural_network import neuralnetwork
+from recording import record_episodes,save_recordings,load_recordings,episodereplayer
 
 g=snakegame()
 s=g.reset()
@@ -12,3 +19,63 @@ while alive and steps<50:
     print(f"step {steps}: alive={alive}, score={score}")
 
 print(f"survived {steps} steps")
+
+#record a few seeded episodes and replay them step by step
+for vision in (False,True):
+    sizes=(38 if vision else 14,16,16,4)
+    genomes=np.stack([neuralnetwork(*sizes).get_params() for _ in range(4)])
+    recordings=record_episodes(genomes,np.arange(4),sizes,max_steps=300,vision=vision)
+    with tempfile.TemporaryDirectory() as tmp:
+        path=os.path.join(tmp,"episodes.rec")
+        save_recordings(recordings,path)
+        loaded=load_recordings(path)
+    for r in loaded:
+        replayer=episodereplayer(r,keyframe_every=16,vision=vision)
+        game=replayer.seek(r.steps)
+        assert game.score==r.score,(game.score,r.score)
+        assert np.array_equal(copy.deepcopy(game).get_state(),game.get_state())
+    print(f"replayed {len(recordings)} recordings (vision={vision})")
+
+#the batch engine must stay in step with snakegame: same states, deaths and scores
+def safe_action(game,rng,greedy=True):
+    """a move that doesn't hit a wall or the body, mostly toward the apple if greedy
+
+    greedy games run long and grow, the others wander until they stagnate
+    """
+    hx,hy=game.snake[0]
+    body=set(list(game.snake)[:-1])
+    moves=[a for a,(dx,dy) in enumerate(((0,-1),(0,1),(-1,0),(1,0)))
+           if 0<=hx+dx<game.width and 0<=hy+dy<game.height and (hx+dx,hy+dy) not in body]
+    if not moves:
+        return 0
+    if not greedy or rng.random()<0.2:
+        return int(rng.choice(moves))
+    ax,ay=game.apple
+    return min(moves,key=lambda a:abs(hx+(0,0,-1,1)[a]-ax)+abs(hy+(-1,1,0,0)[a]-ay))
+
+for vision in (False,True):
+    for early_stop in (False,True):
+        n=16
+        rng=np.random.default_rng(0)
+        env=BatchSnakeEnv(n,seeds=np.arange(n),early_stop=early_stop,vision=vision)
+        games=[snakegame(seed=i,early_stop=early_stop,vision=vision) for i in range(n)]
+        states=[g.get_state().copy() for g in games]
+        alive=np.ones(n,dtype=bool)
+        for t in range(3000):
+            assert np.array_equal(env.state[alive],np.array(states)[alive]),t
+            if not alive.any():
+                break
+            actions=np.array([safe_action(g,rng,i%2==0) if alive[i] else 0 for i,g in enumerate(games)])
+            #and a few circle in place, for the loop detection
+            actions[2::4]=(0,3,1,2)[t%4]
+            _,batch_alive,batch_scores=env.step(actions)
+            for i in np.flatnonzero(alive):
+                state,alive[i],score=games[i].step(int(actions[i]))
+                states[i]=state.copy()
+                assert score==batch_scores[i],(t,i)
+                if not alive[i]:
+                    assert CAUSES[env.causes[i]]==games[i].death_cause,(t,i)
+            assert np.array_equal(alive,batch_alive),t
+        deaths=sorted({games[i].death_cause for i in range(n) if not alive[i]})
+        print(f"batch and scalar engines agree (vision={vision}, early_stop={early_stop}, {t} steps, "
+              f"best score {env.scores.max()}, deaths {deaths})")
@@ -1,107 +1,33 @@
-import pygame
-import numpy as np
+import queue
 import signal
 import sys
-import threading
-import time
-import os
+import multiprocessing as mp
 from neural_network import neuralnetwork
 from agent import snakeagent
 from snake_game import snakegame
-from genetic_algorithm import geneticalgorithm
+from state_encoder import state_size
+from renderer import gamerenderer
+from metrics import metricsreader,DEFAULT_METRICS
+from training_worker import training_process
 
-def load_weights(filename="trained_weights.txt"):
-    """load weights from file if exists"""
-    if not os.path.exists(filename):
-        print(f"no existing weights found at {filename}, starting fresh")
-        return None
-    #create network with 14 inputs and two hidden layers
-    brain = neuralnetwork(input_size=14, hidden_size1=16, hidden_size2=16, output_size=4)
-    
-    with open(filename, "r") as f:
-        lines = f.readlines()
-    
-    #check format by looking for w3 (indicates two hidden layers)
-    has_w3 = any("w3:" in line for line in lines)
-    
-    #count w1 rows to determine input size
-    w1_line_count = 0
-    for line in lines[1:]:  #skip "w1:" header
-        if line.strip() == "b1:":
-            break
-        w1_line_count += 1
-    
-    if has_w3 and w1_line_count == 14:
-        #new format - 14 inputs, two hidden layers
-        #w1: 14 lines
-        idx = 1
-        w1 = []
-        for i in range(14):
-            w1.append(list(map(float, lines[idx+i].strip().split(","))))
-        brain.w1 = np.array(w1)
-        #b1: 1 line
-        idx = 16
-        brain.b1 = np.array([list(map(float, lines[idx].strip().split(",")))])
-        #w2: 16 lines (hidden1 to hidden2)
-        idx = 18
-        w2 = []
-        for i in range(16):
-            w2.append(list(map(float, lines[idx+i].strip().split(","))))
-        brain.w2 = np.array(w2)
-        #b2: 1 line
-        idx = 35
-        brain.b2 = np.array([list(map(float, lines[idx].strip().split(",")))])
-        #w3: 16 lines (hidden2 to output)
-        idx = 37
-        w3 = []
-        for i in range(16):
-            w3.append(list(map(float, lines[idx+i].strip().split(","))))
-        brain.w3 = np.array(w3)
-        #b3: 1 line
-        idx = 54
-        brain.b3 = np.array([list(map(float, lines[idx].strip().split(",")))])
-        print(f"loaded new format weights (14 inputs, 2 hidden layers) from {filename}")
-    elif w1_line_count == 13:
-        #old format - 13 inputs, one hidden layer (16x4), pad to 14 and restructure
-        idx = 1
-        w1 = []
-        for i in range(13):
-            w1.append(list(map(float, lines[idx+i].strip().split(","))))
-        #pad 14th input (apple_distance)
-        w1.append([0.0] * 16)
-        brain.w1 = np.array(w1)
-        #b1
-        idx = 15
-        brain.b1 = np.array([list(map(float, lines[idx].strip().split(",")))])
-        #old w2 was 16x4 (hidden to output), this becomes new w3 (hidden2 to output)
-        idx = 17
-        old_w2 = []
-        for i in range(16):
-            old_w2.append(list(map(float, lines[idx+i].strip().split(","))))
-        #initialize new w2 as identity-like mapping (hidden1 to hidden2)
-        brain.w2 = np.eye(16) * 0.1 + np.random.randn(16, 16) * 0.05
-        brain.b2 = np.zeros((1, 16))
-        #old w2 becomes w3
-        brain.w3 = np.array(old_w2)
-        #b3 from old b2
-        idx = 34
-        brain.b3 = np.array([list(map(float, lines[idx].strip().split(",")))])
-        print(f"loaded old format weights (13 inputs, restructured to 14->16->16->4) from {filename}")
-
-    else:
-        #very old format - just initialize fresh
-        print(f"incompatible weight format, starting fresh")
-        return None
-    
-    return brain
+#imported by VisualTrainer: the spawned training process re-runs this
+#module's top level and must not load pygame/sdl
+pygame = None
 
 class VisualTrainer:
     def __init__(self, pop_size=50):
-        self.ga = geneticalgorithm(pop_size=pop_size)
-        self.training = True
-        self.best_fitness_history = []
-        self.lock = threading.Lock()
+        self.pop_size = pop_size
+        #latest generation published by the training process
+        self.generation = 0
+        self.best_fitness = None
+        self.best_brain = None
+        #the fitness graph reads the training process's metrics log
+        self.metrics = None
+        self.last_stats = None
+        self.trainer = None
         #pygame setup
+        global pygame
+        import pygame
         pygame.init()
         self.screen_width = 1200
         self.screen_height = 600
@@ -114,76 +40,87 @@ class VisualTrainer:
         self.game_area = pygame.Rect(50, 50, 450, 450)  #30x30 * 15px = 450px
         self.stats_area = pygame.Rect(520, 50, 300, 450)
         self.nn_area = pygame.Rect(830, 50, 320, 450)  #neural network visualization
+        #render cache: grid background, nn diagram and stats panel are only
+        #redrawn when their content changes
+        self.renderer = gamerenderer(background=(10, 10, 10))
+        self.nn_surface = None
+        self.nn_brain = None
+        self.stats_key = None
         
-        #load existing weights if available
-        self.load_existing_weights()
-        
-    def load_existing_weights(self):
-        """seed population with existing weights if available"""
-        existing_brain = load_weights("trained_weights.txt")
-        if existing_brain is not None:
-            print("seeding population with existing weights...")
-            #replace first agent with loaded weights
-            self.ga.population[0] = snakeagent(existing_brain)
-            #create variations for next 10 agents
-            for i in range(1, min(11, self.ga.pop_size)):
-                mutated_brain = existing_brain.copy()
-                mutated_brain.mutate(rate=0.05)
-                self.ga.population[i] = snakeagent(mutated_brain)
-            print(f"seeded {min(11, self.ga.pop_size)} agents with existing weights")
-        
-    def train_generation(self):
-        """Train one generation"""
-        self.ga.evolve()
-        with self.lock:
-            self.best_fitness_history.append(self.ga.best.fitness)
-            #keep last 50 gens for display
-            if len(self.best_fitness_history) > 50:
-                self.best_fitness_history = self.best_fitness_history[-50:]
-        #save weights after each gen
-        self.ga.save_weights("trained_weights.txt")
-        
-    def training_loop(self):
-        """Background training loop"""
-        print("training started in bg...")
-        while self.training:
-            self.train_generation()
-            print(f"gen {self.ga.generation}: best fitness = {self.ga.best.fitness}")
-            #small delay to prevent cpu overload
-            time.sleep(0.1)
+    def start_training(self):
+        """start evolution in a separate process"""
+        #spawn, not fork: the child must not inherit this process's sdl state
+        ctx = mp.get_context("spawn")
+        self.updates = ctx.Queue()
+        self.commands = ctx.Queue()
+        self.trainer = ctx.Process(target=training_process, args=(self.pop_size, self.updates, self.commands))
+        self.trainer.start()
+
+    def stop_training(self):
+        """ask the training process to save and exit, then wait for it"""
+        if self.trainer is None:
+            return
+        self.commands.put("stop")
+        self.trainer.join()
+        self.trainer = None
+
+    def poll_updates(self):
+        """take every generation published since the last frame"""
+        while True:
+            try:
+                update = self.updates.get_nowait()
+            except queue.Empty:
+                return
+            self.generation = update["generation"]
+            self.best_fitness = update["fitness"]
+            self.last_stats = update["stats"]
+            brain = neuralnetwork(*update["sizes"])
+            brain.set_params(update["genome"])
+            self.best_brain = brain
             
     def draw_game(self, game):
-        """draw snake game"""
+        """draw snake game, returns the dirty rect"""
         if game is None:
             #draw empty grid
-            pygame.draw.rect(self.screen, (20, 20, 20), self.game_area)
-            return
+            return pygame.draw.rect(self.screen, (20, 20, 20), self.game_area)
         #draw game with offset
-        game.render(self.screen, self.game_area.x, self.game_area.y)
+        rect = self.renderer.render(game, self.screen, self.game_area.x, self.game_area.y)
         #draw border
         pygame.draw.rect(self.screen, (100, 100, 100), self.game_area, 2)
+        return rect.union(self.game_area)
         
     def draw_nn(self, brain):
-        """draw neural network nodes and connections"""
-        if brain is None:
-            return
-            
+        """blit the nn diagram, rebuilding it only when the brain changed
+
+        returns the dirty rect, or None if nothing was drawn
+        """
+        if brain is None or brain is self.nn_brain:
+            return None
+        self.nn_surface = self.build_nn_surface(brain)
+        self.nn_brain = brain
+        return self.screen.blit(self.nn_surface, self.nn_area)
+
+    def build_nn_surface(self, brain):
+        """draw neural network nodes and connections onto a new surface"""
+        surface = pygame.Surface(self.nn_area.size).convert()
+        area = surface.get_rect()
+        
         #clear nn area
-        pygame.draw.rect(self.screen, (25, 25, 25), self.nn_area)
+        pygame.draw.rect(surface, (25, 25, 25), area)
         
-        #nn architecture: 14 inputs -> 16 hidden1 -> 16 hidden2 -> 4 outputs
-        input_nodes = 14
+        #nn architecture: 14 inputs (38 with vision rays) -> 16 hidden1 -> 16 hidden2 -> 4 outputs
+        input_nodes = brain.input_size
         hidden1_nodes = 16
         hidden2_nodes = 16
         output_nodes = 4
         
         #positions - wider spacing for more inputs
-        left_x = self.nn_area.x + 40
-        hidden1_x = self.nn_area.x + 120
-        hidden2_x = self.nn_area.x + 200
-        right_x = self.nn_area.x + 280
-        start_y = self.nn_area.y + 25
-        end_y = self.nn_area.y + self.nn_area.height - 25
+        left_x = area.x + 40
+        hidden1_x = area.x + 120
+        hidden2_x = area.x + 200
+        right_x = area.x + 280
+        start_y = area.y + 25
+        end_y = area.y + area.height - 25
         
         #calculate y positions
         input_ys = [start_y + (end_y - start_y) * i / (input_nodes - 1) for i in range(input_nodes)]
@@ -202,7 +139,7 @@ class VisualTrainer:
                         color = (200, 50, 50) if weight < 0 else (50, 200, 50)
                     else:
                         color = (100, 100, 100) if weight < 0.1 else (150, 150, 150) if weight < 0.5 else (200, 200, 200)
-                    pygame.draw.line(self.screen, color, (left_x, iy), (hidden1_x, hy), 1)
+                    pygame.draw.line(surface, color, (left_x, iy), (hidden1_x, hy), 1)
         
         #hidden1 to hidden2
         for i, hy in enumerate(hidden1_ys):
@@ -210,7 +147,7 @@ class VisualTrainer:
                 if i % 4 == 0 and j % 4 == 0:  #sample for clarity
                     weight = abs(brain.w2[i][j]) if i < brain.w2.shape[0] and j < brain.w2.shape[1] else 0
                     color = (100, 100, 100) if weight < 0.1 else (150, 150, 150) if weight < 0.5 else (200, 200, 200)
-                    pygame.draw.line(self.screen, color, (hidden1_x, hy), (hidden2_x, h2y), 1)
+                    pygame.draw.line(surface, color, (hidden1_x, hy), (hidden2_x, h2y), 1)
         
         #hidden2 to output
         for i, h2y in enumerate(hidden2_ys):
@@ -218,12 +155,15 @@ class VisualTrainer:
                 if i % 4 == 0:  #sample for clarity
                     weight = abs(brain.w3[i][j]) if i < brain.w3.shape[0] and j < brain.w3.shape[1] else 0
                     color = (100, 100, 100) if weight < 0.1 else (150, 150, 150) if weight < 0.5 else (200, 200, 200)
-                    pygame.draw.line(self.screen, color, (hidden2_x, h2y), (right_x, oy), 1)
+                    pygame.draw.line(surface, color, (hidden2_x, h2y), (right_x, oy), 1)
         
         #draw nodes
         #input nodes with color coding
         labels = ["head_x", "head_y", "tail_x", "tail_y", "apple_x", "apple_y", "dir",
                   "d_left", "d_right", "d_top", "d_bot", "to_ap_x", "to_ap_y", "ap_dist"]
+        #vision rays: wall, body and apple per direction
+        rays = ["u", "d", "l", "r", "ul", "ur", "dl", "dr"]
+        labels += [f"{kind}_{ray}" for kind in ("wall", "body", "ap") for ray in rays]
         
         for i, (y, label) in enumerate(zip(input_ys, labels)):
             #color code: blue for position, red for wall dist (danger), green for apple (reward)
@@ -235,69 +175,94 @@ class VisualTrainer:
                 color = (255, 100, 100)  #wall distances (danger - red tint)
             elif i < 13:
                 color = (100, 255, 100)  #apple direction (reward - green tint)
-            else:
+            elif i < 14:
                 color = (255, 255, 100)  #apple distance (yellow)
-            pygame.draw.circle(self.screen, color, (left_x, int(y)), 5)
+            elif i < 30:
+                color = (255, 100, 100)  #wall and body rays (danger)
+            else:
+                color = (100, 255, 100)  #apple rays (reward)
+            pygame.draw.circle(surface, color, (left_x, int(y)), 5)
             text = self.font.render(label, True, (200, 200, 200))
-            self.screen.blit(text, (left_x - 40, int(y) - 4))
+            surface.blit(text, (left_x - 40, int(y) - 4))
         
         #hidden1 nodes
         for i, y in enumerate(hidden1_ys):
-            pygame.draw.circle(self.screen, (255, 150, 0), (hidden1_x, int(y)), 4)
+            pygame.draw.circle(surface, (255, 150, 0), (hidden1_x, int(y)), 4)
         
         #hidden2 nodes
         for i, y in enumerate(hidden2_ys):
-            pygame.draw.circle(self.screen, (255, 100, 150), (hidden2_x, int(y)), 4)
+            pygame.draw.circle(surface, (255, 100, 150), (hidden2_x, int(y)), 4)
         
         #output nodes
         actions = ["up", "down", "left", "right"]
         for i, (y, label) in enumerate(zip(output_ys, actions)):
-            pygame.draw.circle(self.screen, (0, 255, 100), (right_x, int(y)), 7)
+            pygame.draw.circle(surface, (0, 255, 100), (right_x, int(y)), 7)
             text = self.font.render(label, True, (200, 200, 200))
-            self.screen.blit(text, (right_x + 10, int(y) - 5))
+            surface.blit(text, (right_x + 10, int(y) - 5))
         
         #title
-        title = self.big_font.render("NN (14->16->16->4)", True, (255, 255, 255))
-        self.screen.blit(title, (self.nn_area.x + 50, self.nn_area.y + 5))
+        title = self.big_font.render(f"NN ({input_nodes}->16->16->4)", True, (255, 255, 255))
+        surface.blit(title, (area.x + 50, area.y + 5))
         
         #legend
         legend_text = self.font.render("Red=danger, Green=reward", True, (150, 150, 150))
-        self.screen.blit(legend_text, (self.nn_area.x + 40, self.nn_area.y + 420))
+        surface.blit(legend_text, (area.x + 40, area.y + 420))
         
         #border
-        pygame.draw.rect(self.screen, (100, 100, 100), self.nn_area, 2)
+        pygame.draw.rect(surface, (100, 100, 100), area, 2)
+        return surface
         
     def draw_stats(self):
-        """draw stats"""
+        """draw stats when a generation finished; returns the dirty rect or None"""
+        if self.generation == self.stats_key:
+            return None
+        self.stats_key = self.generation
         #clear stats area
         pygame.draw.rect(self.screen, (30, 30, 30), self.stats_area)
         #title
         title = self.big_font.render("Training Statistics", True, (255, 255, 255))
         self.screen.blit(title, (self.stats_area.x + 50, self.stats_area.y + 10))
-        with self.lock:
-            gen_text = self.font.render(f"Generation: {self.ga.generation}", True, (200, 200, 200))
-            self.screen.blit(gen_text, (self.stats_area.x + 20, self.stats_area.y + 50))
-            if hasattr(self.ga, 'best') and self.ga.best:
-                fitness_text = self.font.render(f"Best Fitness: {self.ga.best.fitness:.0f}", True, (200, 200, 200))
-                self.screen.blit(fitness_text, (self.stats_area.x + 20, self.stats_area.y + 75))
-                score_text = self.font.render(f"Best Score: {self.ga.best.fitness // 10000}", True, (200, 200, 200))
-                self.screen.blit(score_text, (self.stats_area.x + 20, self.stats_area.y + 100))
-                snake_len = self.font.render(f"Snake Length: {self.ga.best.fitness // 10000 + 1}", True, (200, 200, 200))
-                self.screen.blit(snake_len, (self.stats_area.x + 20, self.stats_area.y + 125))
-            #draw fitness graph
-            if len(self.best_fitness_history) > 1:
-                graph_rect = pygame.Rect(self.stats_area.x + 20, self.stats_area.y + 160, 260, 120)
-                pygame.draw.rect(self.screen, (50, 50, 50), graph_rect)
-                max_fitness = max(self.best_fitness_history) if self.best_fitness_history else 1
-                min_fitness = min(self.best_fitness_history) if self.best_fitness_history else 0
-                fitness_range = max_fitness - min_fitness if max_fitness != min_fitness else 1
-                points = []
-                for i, fitness in enumerate(self.best_fitness_history):
-                    x = graph_rect.x + (i / (len(self.best_fitness_history) - 1)) * graph_rect.width
-                    y = graph_rect.y + graph_rect.height - ((fitness - min_fitness) / fitness_range) * graph_rect.height
-                    points.append((x, y))
-                if len(points) > 1:
-                    pygame.draw.lines(self.screen, (0, 200, 0), False, points, 2)
+        gen_text = self.font.render(f"Generation: {self.generation}", True, (200, 200, 200))
+        self.screen.blit(gen_text, (self.stats_area.x + 20, self.stats_area.y + 50))
+        if self.best_fitness is not None:
+            fitness_text = self.font.render(f"Best Fitness: {self.best_fitness:.0f}", True, (200, 200, 200))
+            self.screen.blit(fitness_text, (self.stats_area.x + 20, self.stats_area.y + 75))
+            score_text = self.font.render(f"Best Score: {self.best_fitness // 10000}", True, (200, 200, 200))
+            self.screen.blit(score_text, (self.stats_area.x + 20, self.stats_area.y + 100))
+            snake_len = self.font.render(f"Snake Length: {self.best_fitness // 10000 + 1}", True, (200, 200, 200))
+            self.screen.blit(snake_len, (self.stats_area.x + 20, self.stats_area.y + 125))
+        #draw fitness graph
+        if self.metrics is None and self.best_fitness is not None:
+            self.metrics = metricsreader(DEFAULT_METRICS)
+        if self.metrics is not None and self.metrics.refresh() > 1:
+            #whole run, thinned to about one point per pixel
+            history = self.metrics.downsample("best_fitness", 260)
+            graph_rect = pygame.Rect(self.stats_area.x + 20, self.stats_area.y + 160, 260, 120)
+            pygame.draw.rect(self.screen, (50, 50, 50), graph_rect)
+            max_fitness = history.max()
+            min_fitness = history.min()
+            fitness_range = max_fitness - min_fitness if max_fitness != min_fitness else 1
+            points = []
+            for i, fitness in enumerate(history):
+                x = graph_rect.x + (i / (len(history) - 1)) * graph_rect.width
+                y = graph_rect.y + graph_rect.height - ((fitness - min_fitness) / fitness_range) * graph_rect.height
+                points.append((x, y))
+            if len(points) > 1:
+                pygame.draw.lines(self.screen, (0, 200, 0), False, points, 2)
+        #last generation's timings and counters
+        if self.last_stats:
+            stats = self.last_stats
+            phases = stats["phases"]
+            lines = [
+                "eval {:.0f}ms  sel {:.0f}ms".format(phases.get("evaluate", 0) * 1000, phases.get("selection", 0) * 1000),
+                "repro {:.0f}ms  save {:.0f}ms".format(phases.get("reproduce", 0) * 1000, phases.get("save", 0) * 1000),
+                f"Steps: {stats['simulated_steps']} ({stats['steps_per_sec']:.0f}/s)",
+                f"Mean Episode: {stats['mean_episode_length']:.1f} steps",
+                "Deaths: " + " ".join(f"{name}={n}" for name, n in stats["deaths"].items() if n),
+            ]
+            for i, line in enumerate(lines):
+                text = self.font.render(line, True, (180, 180, 180))
+                self.screen.blit(text, (self.stats_area.x + 20, self.stats_area.y + 350 + i * 18))
         #instructions
         instr_text = self.font.render("Press 'Q' to quit, 'S' to save", True, (150, 150, 150))
         self.screen.blit(instr_text, (self.stats_area.x + 20, self.stats_area.y + 300))
@@ -305,18 +270,16 @@ class VisualTrainer:
         self.screen.blit(instr2_text, (self.stats_area.x + 20, self.stats_area.y + 320))
         #border
         pygame.draw.rect(self.screen, (100, 100, 100), self.stats_area, 2)
+        return self.stats_area
         
     def run(self):
         """main loop"""
-        #start bg training thread
-        train_thread = threading.Thread(target=self.training_loop)
-        train_thread.daemon = True
-        train_thread.start()
+        #start training in its own process
+        self.start_training()
         #signal handler
         def signal_handler(sig, frame):
             print("\nsaving weights...")
-            self.ga.save_weights("trained_weights.txt")
-            self.training = False
+            self.stop_training()
             pygame.quit()
             sys.exit(0)
         signal.signal(signal.SIGINT, signal_handler)
@@ -326,6 +289,8 @@ class VisualTrainer:
         demo_steps = 0
         max_demo_steps = 200
         running = True
+        self.screen.fill((10, 10, 10))
+        pygame.display.flip()
         while running:
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
@@ -334,32 +299,30 @@ class VisualTrainer:
                     if event.key == pygame.K_q:
                         running = False
                     elif event.key == pygame.K_s:
-                        self.ga.save_weights("trained_weights.txt")
-                        print("weights saved manually")
-            #clear screen
-            self.screen.fill((10, 10, 10))
+                        self.commands.put("save")
+            self.poll_updates()
+            #only the areas that changed are redrawn and pushed to the display
+            dirty = []
             #update demo game w/best agent
-            with self.lock:
-                if hasattr(self.ga, 'best') and self.ga.best:
-                    if demo_game is None or not demo_agent or demo_steps >= max_demo_steps:
-                        demo_game = snakegame()
-                        demo_state = demo_game.reset()
-                        demo_agent = snakeagent(self.ga.best.brain.copy())
-                        demo_steps = 0
-                    action = demo_agent.get_action(demo_state)
-                    demo_state, alive, score = demo_game.step(action)
-                    demo_steps += 1
-                    if not alive:
-                        demo_game = None
-                        demo_agent = None
-                    self.draw_game(demo_game)
-                    self.draw_nn(self.ga.best.brain)
-            self.draw_stats()
-            pygame.display.flip()
+            if self.best_brain is not None:
+                if demo_game is None or not demo_agent or demo_steps >= max_demo_steps:
+                    demo_game = snakegame(vision=self.best_brain.input_size == state_size(True))
+                    demo_state = demo_game.reset()
+                    demo_agent = snakeagent(self.best_brain.freeze())
+                    demo_steps = 0
+                action = demo_agent.get_action(demo_state)
+                demo_state, alive, score = demo_game.step(action)
+                demo_steps += 1
+                if not alive:
+                    demo_game = None
+                    demo_agent = None
+                dirty.append(self.draw_game(demo_game))
+                dirty.append(self.draw_nn(self.best_brain))
+            dirty.append(self.draw_stats())
+            pygame.display.update([rect for rect in dirty if rect])
             self.clock.tick(15)
         #cleanup
-        self.training = False
-        self.ga.save_weights("trained_weights.txt")
+        self.stop_training()
         print("saved.")
         pygame.quit()
 
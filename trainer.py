@@ -0,0 +1,62 @@
+"""what geneticalgorithm and evolutionstrategy share: per-phase timings,
+the stats of a generation's episodes, callbacks and saving the best weights
+
+subclasses set self.stats, self.callbacks, self.writer (a
+checkpointwriter), self.best and self.generation
+"""
+import time
+from contextlib import contextmanager
+import numpy as np
+from checkpoint import DEFAULT_WEIGHTS
+from batch_snake_game import CAUSES
+from metrics import QUANTILES
+
+
+def episode_stats(scores,steps,causes,simulated_steps,evaluate_time,played=None):
+    """the per-episode part of a generation's stats from (agents,episodes) results
+
+    played marks the episodes that count (with racing not every agent
+    plays them all); steps are those of the agents, simulated_steps every
+    step the generation took
+    """
+    if played is None:
+        played=np.ones(steps.shape,dtype=bool)
+    counts=np.bincount(causes[played],minlength=len(CAUSES))
+    return {
+        "score_quantiles":np.quantile(scores.sum(axis=1)/played.sum(axis=1),QUANTILES).tolist(),
+        "episodes":int(played.sum()),
+        "simulated_steps":simulated_steps,
+        "steps_per_sec":simulated_steps/evaluate_time if evaluate_time>0 else 0.0,
+        "mean_episode_length":float(steps[played].mean()),
+        "deaths":{name:int(n) for name,n in zip(CAUSES[1:],counts[1:])},
+    }
+
+
+class trainer:
+    @contextmanager
+    def phase(self,name):
+        """add the wall time of the block to stats["phases"][name]"""
+        start=time.perf_counter()
+        try:
+            yield
+        finally:
+            phases=self.stats["phases"] if self.stats else {}
+            phases[name]=phases.get(name,0.0)+time.perf_counter()-start
+
+    def add_callback(self,callback):
+        """call callback(trainer,stats) after every generation"""
+        self.callbacks.append(callback)
+
+    def save_weights(self,filename=DEFAULT_WEIGHTS,wait=False):
+        """save best weights to file
+
+        the write happens on a background thread (atomically, via a temp
+        file); pass wait=True to block until it is on disk
+        """
+        if getattr(self,"best",None) is None:
+            return
+        with self.phase("save"):
+            self.writer.submit(self.best.brain,filename,self.best.fitness,self.generation)
+            if wait:
+                self.writer.flush()
+        print(f"Generation {self.generation}: weights saved to {filename} (fitness={self.best.fitness})")
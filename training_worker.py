@@ -0,0 +1,77 @@
+"""the evolution half of the visual trainer (train.py)
+
+it runs in a spawned process, so it lives apart from the ui and never
+loads pygame
+"""
+import queue
+import signal
+from agent import snakeagent
+from genetic_algorithm import geneticalgorithm
+from checkpoint import load_weights
+from state_encoder import state_size
+from metrics import metricswriter, DEFAULT_METRICS
+
+def seed_population(ga, existing_brain):
+    """seed population with existing weights if available"""
+    if existing_brain is not None:
+        sizes = (existing_brain.input_size, existing_brain.hidden_size1,
+                 existing_brain.hidden_size2, existing_brain.output_size)
+        if sizes != tuple(ga.layer_sizes()):
+            print(f"not seeding: saved weights have layer sizes {sizes}, population has {tuple(ga.layer_sizes())}")
+            return
+        print("seeding population with existing weights...")
+        #replace first agent with loaded weights
+        ga.population[0] = snakeagent(existing_brain)
+        #create variations for next 10 agents
+        for i in range(1, min(11, ga.pop_size)):
+            mutated_brain = existing_brain.copy()
+            mutated_brain.mutate(rate=0.05)
+            ga.population[i] = snakeagent(mutated_brain)
+        print(f"seeded {min(11, ga.pop_size)} agents with existing weights")
+
+def training_process(pop_size, updates, commands):
+    """evolve in its own process, publishing every generation to updates
+
+    the ui sends "save" and "stop" through commands; weights are saved
+    after each generation and once more on the way out
+    """
+    #ctrl+c is handled by the ui, which tells this process to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    #updates are only for display, don't hang on exit if the ui stopped reading
+    updates.cancel_join_thread()
+    existing_brain = load_weights()
+    #weights trained with --vision take the 38 ray inputs, keep training on those
+    vision = existing_brain is not None and existing_brain.input_size == state_size(True)
+    ga = geneticalgorithm(pop_size=pop_size, vision=vision)
+    seed_population(ga, existing_brain)
+    log = metricswriter(DEFAULT_METRICS)
+    print("training started in bg...")
+    running = True
+    try:
+        while running:
+            ga.evolve()
+            #save weights after each gen
+            ga.save_weights()
+            log.append(ga.stats)
+            print(f"gen {ga.generation}: best fitness = {ga.best.fitness}")
+            updates.put({
+                "generation": ga.generation,
+                "fitness": ga.best.fitness,
+                "sizes": ga.layer_sizes(),
+                "genome": ga.best.brain.get_params(),
+                "stats": ga.stats,
+            })
+            while True:
+                try:
+                    command = commands.get_nowait()
+                except queue.Empty:
+                    break
+                if command == "save":
+                    ga.save_weights(wait=True)
+                    print("weights saved manually")
+                elif command == "stop":
+                    running = False
+    finally:
+        ga.save_weights(wait=True)
+        ga.close()
+        log.close()